@@ -0,0 +1,170 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import db
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Bucket width in seconds for each granularity, finest first
+GRANULARITIES: Dict[str, int] = {"minute": 60, "hour": 3600, "day": 86400}
+LEVELS = list(GRANULARITIES)
+TABLES = {"minute": "clicks_minute", "hour": "clicks_hour", "day": "clicks_day"}
+
+_stop_event = threading.Event()
+_compact_thread: Optional[threading.Thread] = None
+
+
+def bucket_start(timestamp: float, granularity: str) -> int:
+    """Return the start (unix seconds, UTC) of the bucket containing timestamp."""
+    width = GRANULARITIES[granularity]
+    return int(timestamp) - int(timestamp) % width
+
+
+def record_buckets(conn: sqlite3.Connection, buckets: Iterable[Tuple[str, int, int]]) -> None:
+    """
+    Add (slug, minute bucket, clicks) counts to the minute table; call inside a
+    write transaction. Minutes that were already rolled up into hours, e.g. by a
+    flush retried after a failure, are counted in the first minute that was not,
+    so they stay in the time series as well as in the totals. Counts for links
+    that were deleted before the flush are dropped, so a slug created again
+    later does not inherit them.
+    """
+    rolled_up_until = _get_watermarks(conn)["hour"]
+    conn.executemany(
+        "INSERT INTO clicks_minute (slug, bucket, clicks) "
+        "SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM urls WHERE slug = ?) "
+        "ON CONFLICT(slug, bucket) DO UPDATE SET clicks = clicks + excluded.clicks",
+        [(slug, max(minute, rolled_up_until), count, slug) for slug, minute, count in buckets]
+    )
+
+
+def delete_slug_analytics(conn: sqlite3.Connection, slug: str) -> None:
+    """Remove all time-bucketed clicks for a slug."""
+    for table in TABLES.values():
+        conn.execute(f"DELETE FROM {table} WHERE slug = ?", (slug,))
+
+
+def _get_watermarks(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Return, per rollup level, the time before which finer buckets have been rolled up."""
+    rows = conn.execute("SELECT granularity, compacted_until FROM analytics_watermarks").fetchall()
+    watermarks = {"hour": 0, "day": 0}
+    watermarks.update({row["granularity"]: row["compacted_until"] for row in rows})
+    return watermarks
+
+
+def _roll_up(conn: sqlite3.Connection, source: str, target: str, start: int, end: int) -> None:
+    """Sum source buckets in [start, end) into target buckets."""
+    width = GRANULARITIES[target]
+    conn.execute(
+        f"INSERT INTO {TABLES[target]} (slug, bucket, clicks) "
+        f"SELECT slug, bucket - bucket % {width} AS rollup, SUM(clicks) FROM {TABLES[source]} "
+        f"WHERE bucket >= ? AND bucket < ? GROUP BY slug, rollup "
+        f"ON CONFLICT(slug, bucket) DO UPDATE SET clicks = clicks + excluded.clicks",
+        (start, end)
+    )
+    conn.execute(
+        "INSERT INTO analytics_watermarks (granularity, compacted_until) VALUES (?, ?) "
+        "ON CONFLICT(granularity) DO UPDATE SET compacted_until = excluded.compacted_until",
+        (target, end)
+    )
+
+
+def compact(now: Optional[float] = None) -> List[Dict[str, int]]:
+    """Compact the click buckets of every shard; returns each shard's watermarks."""
+    now = time.time() if now is None else now
+    return [compact_shard(shard, now) for shard in range(db.shard_count())]
+
+
+def compact_shard(shard: int, now: float) -> Dict[str, int]:
+    """
+    Roll complete minutes up into hours and complete hours into days, then
+    apply retention. Rows are only deleted once they are covered by the next
+    coarser level, so totals are never lost. Safe to run from several workers.
+    """
+    # Leave recent buckets alone so late click flushes still land before rollup
+    hour_end = bucket_start(now - config.ANALYTICS_COMPACT_GRACE, "hour")
+    with db.get_db_connection(shard) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            watermarks = _get_watermarks(conn)
+            if hour_end > watermarks["hour"]:
+                _roll_up(conn, "minute", "hour", watermarks["hour"], hour_end)
+                watermarks["hour"] = hour_end
+            day_end = bucket_start(watermarks["hour"], "day")
+            if day_end > watermarks["day"]:
+                _roll_up(conn, "hour", "day", watermarks["day"], day_end)
+                watermarks["day"] = day_end
+
+            minute_cutoff = min(watermarks["hour"], now - config.ANALYTICS_MINUTE_RETENTION_HOURS * 3600)
+            conn.execute("DELETE FROM clicks_minute WHERE bucket < ?", (int(minute_cutoff),))
+            hour_cutoff = min(watermarks["day"], now - config.ANALYTICS_HOUR_RETENTION_DAYS * 86400)
+            conn.execute("DELETE FROM clicks_hour WHERE bucket < ?", (int(hour_cutoff),))
+            if config.ANALYTICS_DAY_RETENTION_DAYS > 0:
+                day_cutoff = now - config.ANALYTICS_DAY_RETENTION_DAYS * 86400
+                conn.execute("DELETE FROM clicks_day WHERE bucket < ?", (int(day_cutoff),))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return watermarks
+
+
+def query_clicks(slug: str, granularity: str, start: int, end: int) -> Dict[int, int]:
+    """
+    Return clicks per bucket of the given granularity in [start, end), widened
+    to whole buckets. Each table answers the time range it is authoritative
+    for: the requested level up to its watermark, and each finer level from the
+    watermark of the level above it. Finer rows are re-bucketed with GROUP BY.
+    """
+    index = LEVELS.index(granularity)
+    width = GRANULARITIES[granularity]
+    start = bucket_start(start, granularity)
+    end = -(-end // width) * width
+    series: Dict[int, int] = {}
+    with db.get_slug_connection(slug) as conn:
+        watermarks = _get_watermarks(conn)
+        for j in range(index, -1, -1):
+            level = LEVELS[j]
+            lower = start if j == index else max(start, watermarks[LEVELS[j + 1]])
+            upper = end if level == "minute" else min(end, watermarks[level])
+            if lower >= upper:
+                continue
+            rows = conn.execute(
+                f"SELECT bucket - bucket % {width} AS rollup, SUM(clicks) AS clicks FROM {TABLES[level]} "
+                f"WHERE slug = ? AND bucket >= ? AND bucket < ? GROUP BY rollup",
+                (slug, lower, upper)
+            ).fetchall()
+            for row in rows:
+                series[row["rollup"]] = series.get(row["rollup"], 0) + row["clicks"]
+    return series
+
+
+def _compact_loop() -> None:
+    while not _stop_event.wait(config.ANALYTICS_COMPACT_INTERVAL):
+        try:
+            compact()
+        except Exception as e:
+            logger.error(f"Error compacting click analytics: {e}")
+
+
+def start_compactor() -> None:
+    """Start the background thread that rolls up and expires click buckets."""
+    global _compact_thread
+    if _compact_thread is not None and _compact_thread.is_alive():
+        return
+    _stop_event.clear()
+    _compact_thread = threading.Thread(target=_compact_loop, name="analytics-compactor", daemon=True)
+    _compact_thread.start()
+
+
+def stop_compactor() -> None:
+    """Stop the background compaction thread."""
+    global _compact_thread
+    _stop_event.set()
+    if _compact_thread is not None:
+        _compact_thread.join(timeout=config.DATABASE_TIMEOUT)
+        _compact_thread = None
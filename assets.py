@@ -0,0 +1,172 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from config import config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Hashed asset URLs never change content, so browsers may cache them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Pages and unhashed URLs are revalidated with the ETag on every use
+REVALIDATE_CACHE_CONTROL = "no-cache"
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+# Smaller bodies are not worth the Content-Encoding overhead
+MIN_COMPRESS_SIZE = 256
+# Files whose references to other assets are rewritten to hashed URLs
+REWRITTEN_SUFFIXES = (".html", ".css")
+
+
+class StaticAsset:
+    """A file held in memory along with its precompressed encodings and ETags."""
+
+    def __init__(self, name: str, body: bytes, content_type: str) -> None:
+        self.name = name
+        self.content_type = content_type
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.hashed_name = _hashed_name(name, self.digest[:12])
+        # Encoding -> (body, strong ETag); identity is always present
+        self.encodings: Dict[str, Tuple[bytes, str]] = {"identity": (body, f'"{self.digest[:32]}"')}
+        if len(body) >= MIN_COMPRESS_SIZE and content_type.startswith(COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                self.encodings["gzip"] = (compressed, f'"{self.digest[:32]}-gz"')
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    self.encodings["br"] = (compressed, f'"{self.digest[:32]}-br"')
+
+    def select_encoding(self, accept_encoding: str) -> str:
+        """Pick the smallest encoding the client accepts."""
+        accepted = set()
+        for part in accept_encoding.split(","):
+            coding, _, params = part.strip().partition(";")
+            if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                continue
+            accepted.add(coding.strip().lower())
+        for encoding in ("br", "gzip"):
+            if encoding in self.encodings and (encoding in accepted or "*" in accepted):
+                return encoding
+        return "identity"
+
+
+def _hashed_name(name: str, digest: str) -> str:
+    root, ext = os.path.splitext(name)
+    return f"{root}.{digest}{ext}"
+
+
+def _content_type(name: str) -> str:
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    if content_type.startswith("text/") or content_type in ("application/javascript", "application/json"):
+        content_type += "; charset=utf-8"
+    return content_type
+
+
+def _etag_matches(if_none_match: str, etags: List[str]) -> bool:
+    """Weak comparison as required for If-None-Match."""
+    if if_none_match.strip() == "*":
+        return True
+    candidates = set()
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        candidates.add(tag[2:] if tag.startswith("W/") else tag)
+    return any(etag in candidates for etag in etags)
+
+
+class AssetStore:
+    """
+    Serves the files in a directory from memory.
+    Files are read and compressed once by load(). Every asset is reachable
+    under its plain name and under a content-hashed name; references to other
+    assets inside HTML and CSS files are rewritten to the hashed names, so
+    those can be cached as immutable while pages are revalidated cheaply with
+    strong ETags and 304 responses.
+    """
+
+    def __init__(self, directory: str, url_prefix: str) -> None:
+        self.directory = directory
+        self.url_prefix = url_prefix.rstrip("/")
+        self.assets: Dict[str, StaticAsset] = {}
+        self.hashed: Dict[str, StaticAsset] = {}
+        self.loaded = False
+
+    def load(self) -> None:
+        """Read, fingerprint and precompress every file in the directory."""
+        files: Dict[str, bytes] = {}
+        for root, _, names in os.walk(self.directory):
+            for filename in names:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    files[name] = f.read()
+
+        # Fingerprint files that reference nothing first so references can be rewritten
+        plain = {name: body for name, body in files.items() if not name.endswith(REWRITTEN_SUFFIXES)}
+        assets = {name: StaticAsset(name, body, _content_type(name)) for name, body in plain.items()}
+        for name, body in files.items():
+            if name not in assets:
+                assets[name] = StaticAsset(name, self._rewrite(body, assets), _content_type(name))
+
+        self.assets = assets
+        self.hashed = {asset.hashed_name: asset for asset in assets.values()}
+        self.loaded = True
+        sizes = ", ".join(
+            f"{name} {len(asset.encodings['identity'][0])}B"
+            + "".join(f" {enc} {len(body)}B" for enc, (body, _) in asset.encodings.items() if enc != "identity")
+            for name, asset in sorted(assets.items())
+        )
+        logger.info(f"Loaded {len(assets)} static assets from {self.directory}: {sizes}")
+
+    def _rewrite(self, body: bytes, assets: Dict[str, StaticAsset]) -> bytes:
+        """Point references like /static/styles.css at the asset's hashed URL."""
+        text = body.decode("utf-8")
+        for name, asset in assets.items():
+            text = re.sub(
+                re.escape(f"{self.url_prefix}/{name}") + r"(?=[\"')?#\s])",
+                f"{self.url_prefix}/{asset.hashed_name}",
+                text
+            )
+        return text.encode("utf-8")
+
+    def get(self, name: str) -> Tuple[Optional[StaticAsset], bool]:
+        """Look up an asset by plain or hashed name; the flag tells whether it was hashed."""
+        if not self.loaded:
+            self.load()
+        asset = self.hashed.get(name)
+        if asset is not None:
+            return asset, True
+        return self.assets.get(name), False
+
+    def response(self, request: Request, asset: StaticAsset, immutable: bool) -> Response:
+        """Build a 200 or 304 response in the best encoding the client accepts; HEAD gets the headers only."""
+        encoding = asset.select_encoding(request.headers.get("accept-encoding", ""))
+        body, etag = asset.encodings[encoding]
+        headers = {
+            "ETag": etag,
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        }
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, [etag]):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(body))
+            return Response(media_type=asset.content_type, headers=headers)
+        return Response(content=body, media_type=asset.content_type, headers=headers)
+
+
+static_assets = AssetStore(config.STATIC_DIR, "/static")
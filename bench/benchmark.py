@@ -0,0 +1,336 @@
+"""
+Load-test and benchmark harness for the URL shortener.
+
+Seeds a SQLite database with N links whose popularity follows a Zipf
+distribution, then drives the ASGI app either in-process (through
+httpx.ASGITransport) or over a local uvicorn socket, and reports throughput
+and latency percentiles per scenario as JSON.
+
+Usage (from the repository root):
+    python -m bench.benchmark --links 100000 --requests 5000 --concurrency 32
+    python -m bench.benchmark --mode socket --workers 4 --output run.json
+    python -m bench.benchmark compare baseline.json run.json
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import sqlite3
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = [
+    "redirect_hit", "redirect_miss", "not_found",
+    "shorten_single", "shorten_concurrent", "list_page", "list_stream",
+]
+
+
+class ZipfSampler:
+    """Samples link ranks with probability proportional to 1 / rank**s."""
+
+    def __init__(self, n: int, s: float, rng: random.Random) -> None:
+        total = 0.0
+        self.cumulative: List[float] = []
+        for rank in range(1, n + 1):
+            total += 1.0 / rank ** s
+            self.cumulative.append(total)
+        self.total = total
+        self.rng = rng
+
+    def sample(self) -> int:
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.total)
+
+
+def seed_database(path: str, links: int, rng: random.Random) -> List[str]:
+    """Create the schema and insert the given number of links; returns their slugs."""
+    os.environ["DATABASE_FILE"] = path
+    sys.path.insert(0, REPO_ROOT)
+    import db
+    db.init_db()
+    alphabet = string.ascii_letters + string.digits
+    slugs = list({"".join(rng.choice(alphabet) for _ in range(8)) for _ in range(links)})
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT OR IGNORE INTO urls (slug, long_url) VALUES (?, ?)",
+        ((slug, f"https://example.com/{i}/{slug}") for i, slug in enumerate(slugs))
+    )
+    conn.execute("COMMIT")
+    conn.close()
+    return slugs
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+async def drive(
+    client: httpx.AsyncClient,
+    make_request: Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]],
+    total: int,
+    concurrency: int,
+    expected_status: int
+) -> Dict[str, Any]:
+    """Issue total requests with the given concurrency and summarize latencies."""
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                response = await make_request(client, i)
+                if response.status_code != expected_status:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "duration_s": duration,
+        "throughput_rps": total / duration if duration else 0.0,
+        "latency_ms": {
+            "mean": 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": 1000 * percentile(latencies, 50),
+            "p95": 1000 * percentile(latencies, 95),
+            "p99": 1000 * percentile(latencies, 99),
+            "max": 1000 * latencies[-1] if latencies else 0.0,
+        },
+    }
+
+
+@asynccontextmanager
+async def in_process_client() -> AsyncIterator[httpx.AsyncClient]:
+    """Run the app's lifespan and yield a client that calls it without a socket."""
+    import main
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            yield client
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@asynccontextmanager
+async def socket_client(workers: int, env: Dict[str, str]) -> AsyncIterator[httpx.AsyncClient]:
+    """Start uvicorn on a local port and yield a client connected to it."""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=REPO_ROOT, env={**os.environ, **env}
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    try:
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+            for _ in range(200):
+                try:
+                    await client.get("/api/db/stats")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("uvicorn did not start")
+            yield client
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+async def run_scenario(name: str, client: httpx.AsyncClient, slugs: List[str], args: argparse.Namespace,
+                       rng: random.Random, in_process: bool) -> Dict[str, Any]:
+    """Run one scenario against the client."""
+    zipf = ZipfSampler(len(slugs), args.zipf, rng)
+
+    if name == "redirect_hit":
+        hot = [slugs[zipf.sample()] for _ in range(args.requests)]
+        for slug in set(hot):
+            await client.get(f"/{slug}")
+
+        async def request(c: httpx.AsyncClient, i: int) -> httpx.Response:
+            return await c.get(f"/{hot[i]}")
+        return await drive(client, request, args.requests, args.concurrency, 307)
+
+    if name == "redirect_miss":
+        # Each request uses a slug that is not cached; in-process the cache is disabled outright
+        if in_process:
+            from routers import redirect
+            redirect.url_cache.clear()
+            redirect.url_cache.max_size = 0
+        picks = rng.sample(slugs, min(args.requests, len(slugs)))
+        try:
+            async def request(c: httpx.AsyncClient, i: int) -> httpx.Response:
+                return await c.get(f"/{picks[i % len(picks)]}")
+            return await drive(client, request, args.requests, args.concurrency, 307)
+        finally:
+            if in_process:
+                from config import config
+                redirect.url_cache.max_size = config.CACHE_MAX_SIZE
+
+    if name == "not_found":
+        async def request(c: httpx.AsyncClient, i: int) -> httpx.Response:
+            return await c.get(f"/missing-{i}-{rng.getrandbits(32):x}")
+        return await drive(client, request, args.requests, args.concurrency, 404)
+
+    if name in ("shorten_single", "shorten_concurrent"):
+        concurrency = 1 if name == "shorten_single" else args.concurrency
+        total = max(1, args.requests // 5) if name == "shorten_single" else args.requests
+
+        async def request(c: httpx.AsyncClient, i: int) -> httpx.Response:
+            return await c.post("/api/shorten", json={"long_url": f"https://bench.example.com/{name}/{i}"})
+        return await drive(client, request, total, concurrency, 200)
+
+    if name == "list_page":
+        async def request(c: httpx.AsyncClient, i: int) -> httpx.Response:
+            return await c.get("/api/urls", params={"limit": 1000})
+        return await drive(client, request, max(1, args.requests // 50), args.concurrency, 200)
+
+    if name == "list_stream":
+        async def request(c: httpx.AsyncClient, i: int) -> httpx.Response:
+            return await c.get("/api/urls", params={"stream": "ndjson"})
+        return await drive(client, request, args.stream_requests, 1, 200)
+
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="url-shortener-bench-")
+    db_file = os.path.join(workdir, "bench.db")
+    seed_start = time.perf_counter()
+    slugs = seed_database(db_file, args.links, rng)
+    seed_seconds = time.perf_counter() - seed_start
+
+    scenarios = args.scenarios or SCENARIOS
+    results = []
+    for name in scenarios:
+        if args.mode == "inprocess":
+            client_context = in_process_client()
+        else:
+            env = {"DATABASE_FILE": db_file}
+            if name == "redirect_miss":
+                env["CACHE_MAX_SIZE"] = "0"
+            client_context = socket_client(args.workers, env)
+        async with client_context as client:
+            result = await run_scenario(name, client, slugs, args, rng, args.mode == "inprocess")
+        result.update({"scenario": name, "mode": args.mode})
+        results.append(result)
+        print(
+            f"{name:20s} {result['throughput_rps']:10.1f} req/s  "
+            f"p50 {result['latency_ms']['p50']:7.2f} ms  p95 {result['latency_ms']['p95']:7.2f} ms  "
+            f"p99 {result['latency_ms']['p99']:7.2f} ms  errors {result['errors']}",
+            file=sys.stderr
+        )
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "mode": args.mode,
+            "workers": args.workers if args.mode == "socket" else 1,
+            "links": len(slugs),
+            "zipf": args.zipf,
+            "seed": args.seed,
+            "seed_seconds": seed_seconds,
+        },
+        "results": results,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline_path: str, candidate_path: str) -> None:
+    """Print throughput and p99 changes between two result files."""
+    with open(baseline_path) as f:
+        baseline = {r["scenario"]: r for r in json.load(f)["results"]}
+    with open(candidate_path) as f:
+        candidate = {r["scenario"]: r for r in json.load(f)["results"]}
+    print(f"{'scenario':20s} {'req/s':>12s} {'change':>8s} {'p99 ms':>10s} {'change':>8s}")
+    for name, result in candidate.items():
+        base = baseline.get(name)
+        rps, p99 = result["throughput_rps"], result["latency_ms"]["p99"]
+        if base is None:
+            print(f"{name:20s} {rps:12.1f} {'':>8s} {p99:10.2f}")
+            continue
+        rps_change = (rps / base["throughput_rps"] - 1) * 100 if base["throughput_rps"] else 0.0
+        p99_change = (p99 / base["latency_ms"]["p99"] - 1) * 100 if base["latency_ms"]["p99"] else 0.0
+        print(f"{name:20s} {rps:12.1f} {rps_change:+7.1f}% {p99:10.2f} {p99_change:+7.1f}%")
+
+
+def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+        parser.add_argument("command")
+        parser.add_argument("baseline")
+        parser.add_argument("candidate")
+        args = parser.parse_args()
+        compare(args.baseline, args.candidate)
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark the URL shortener")
+    parser.add_argument("--mode", choices=["inprocess", "socket"], default="inprocess")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers in socket mode")
+    parser.add_argument("--links", type=int, default=100000, help="number of links to seed")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of link popularity")
+    parser.add_argument("--requests", type=int, default=5000, help="requests per scenario")
+    parser.add_argument("--stream-requests", type=int, default=3, help="full streamed listings to fetch")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--scenario", dest="scenarios", action="append", choices=SCENARIOS,
+                        help="run only this scenario (repeatable)")
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+    os.chdir(REPO_ROOT)
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
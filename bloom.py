@@ -0,0 +1,315 @@
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import struct
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import db
+from config import config
+
+logger = logging.getLogger(__name__)
+
+_FILE_MAGIC = b"SLBF"
+_FILE_VERSION = 2
+# magic, version, bit count, hash count, item count, capacity, stale count, shard count;
+# followed by the last id of every shard and then the bits
+_FILE_HEADER = struct.Struct("<4sIQIQQQI")
+_SHARD_ID = struct.Struct("<Q")
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings using double hashing."""
+
+    def __init__(self, capacity: int, fp_rate: float) -> None:
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str) -> Iterable[int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, key: str) -> None:
+        """Add a key to the filter."""
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self.bits)
+
+    def estimated_fp_rate(self, items: Optional[int] = None) -> float:
+        """Estimate the false-positive rate for the given number of items (default: count)."""
+        n = self.count if items is None else items
+        return (1 - math.exp(-self.num_hashes * n / self.num_bits)) ** self.num_hashes
+
+
+class SlugFilter:
+    """
+    Bloom filter over every slug in the urls table.
+    A negative answer from the filter means the slug definitely does not exist,
+    so the lookup can be answered without querying the table. Slugs created by
+    other processes are picked up on demand: before trusting a negative answer
+    the filter checks PRAGMA data_version on its own connection, and only when
+    another connection has committed does it read rows with a higher id. With
+    several shards this is tracked per shard.
+    Deleted slugs cannot be removed from a Bloom filter, so they are counted
+    as stale and the filter is rebuilt once too many accumulate.
+    Syncs query SQLite under a separate lock; the lock taken by add() and
+    remove() on the event loop only guards the in-memory filter.
+    """
+
+    def __init__(self, capacity: int, fp_rate: float, path: str = "") -> None:
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.path = path
+        self.ready = False
+        self._filter = BloomFilter(capacity, fp_rate)
+        self._last_ids = [0] * db.shard_count()
+        self._stale = 0
+        self._data_versions: List[Optional[int]] = [None] * db.shard_count()
+        self._conns: List[Optional[sqlite3.Connection]] = [None] * db.shard_count()
+        # Guards the filter and counters; never held during database I/O
+        self._lock = threading.Lock()
+        # Serializes syncs, which use the filter's own connections and sync positions
+        self._sync_lock = threading.Lock()
+        self._rebuilding = False
+        # Lookup statistics
+        self.definite_misses = 0
+        self.false_positives = 0
+        self.syncs = 0
+        self.builds = 0
+        self.last_build_seconds = 0.0
+
+    def _connection(self, shard: int) -> sqlite3.Connection:
+        # data_version is tracked per connection, so the filter keeps its own
+        if self._conns[shard] is None:
+            path = db.shard_paths(config.DATABASE_FILE, db.shard_count())[shard]
+            self._conns[shard] = sqlite3.connect(path, timeout=config.DATABASE_TIMEOUT,
+                                                 isolation_level=None, check_same_thread=False)
+        return self._conns[shard]
+
+    def _catch_up(self) -> None:
+        """Add slugs committed since the last sync; caller holds the sync lock."""
+        for shard in range(len(self._conns)):
+            conn = self._connection(shard)
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if version == self._data_versions[shard]:
+                continue
+            rows = conn.execute(
+                "SELECT id, slug FROM urls WHERE id > ? ORDER BY id", (self._last_ids[shard],)
+            ).fetchall()
+            with self._lock:
+                for _, slug in rows:
+                    self._filter.add(slug)
+                if rows:
+                    self._last_ids[shard] = rows[-1][0]
+                if self._filter.count > self._filter.capacity:
+                    self._schedule_rebuild()
+            self._data_versions[shard] = version
+            self.syncs += 1
+
+    def might_contain(self, slug: str) -> bool:
+        """In-memory check; False means the slug was not present as of the last sync."""
+        if not self.ready:
+            return True
+        return slug in self._filter
+
+    def confirm_missing(self, slug: str) -> bool:
+        """Sync with the database and return True if the slug definitely does not exist."""
+        if not self.ready:
+            return False
+        with self._sync_lock:
+            try:
+                self._catch_up()
+            except sqlite3.Error as e:
+                logger.error(f"Error syncing slug filter: {e}")
+                return False
+        missing = slug not in self._filter
+        if missing:
+            self.definite_misses += 1
+        return missing
+
+    def filter_possible(self, slugs: List[str]) -> List[str]:
+        """Return the slugs that may exist; the rest definitely do not."""
+        if not self.ready:
+            return slugs
+        with self._sync_lock:
+            try:
+                self._catch_up()
+            except sqlite3.Error as e:
+                logger.error(f"Error syncing slug filter: {e}")
+                return slugs
+        bloom = self._filter
+        return [slug for slug in slugs if slug in bloom]
+
+    def record_false_positive(self) -> None:
+        """Count a lookup the filter let through that turned out not to exist."""
+        self.false_positives += 1
+
+    def add(self, slug: str) -> None:
+        """Add a newly created slug."""
+        with self._lock:
+            self._filter.add(slug)
+            if self._filter.count > self._filter.capacity:
+                self._schedule_rebuild()
+
+    def remove(self, slug: str) -> None:
+        """Note a deleted slug; it stays in the filter until the next rebuild."""
+        with self._lock:
+            self._stale += 1
+            if self._stale > self._filter.count * config.SLUG_FILTER_MAX_STALE_RATIO:
+                self._schedule_rebuild()
+
+    def _schedule_rebuild(self) -> None:
+        if self._rebuilding or not self.ready:
+            return
+        self._rebuilding = True
+        threading.Thread(target=self.build, name="slug-filter-rebuild", daemon=True).start()
+
+    def build(self) -> None:
+        """Build a new filter from the urls table and swap it in."""
+        start = time.perf_counter()
+        try:
+            total = 0
+            for shard in range(len(self._conns)):
+                with db.get_db_connection(shard) as conn:
+                    total += conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+            new_filter = BloomFilter(max(self.capacity, total * 2), self.fp_rate)
+            last_ids = [0] * len(self._conns)
+            for shard in range(len(self._conns)):
+                with db.get_db_connection(shard) as conn:
+                    cursor = conn.execute("SELECT id, slug FROM urls ORDER BY id")
+                    while True:
+                        rows = cursor.fetchmany(10000)
+                        if not rows:
+                            break
+                        for row in rows:
+                            new_filter.add(row["slug"])
+                        last_ids[shard] = rows[-1]["id"]
+            with self._sync_lock:
+                with self._lock:
+                    self._filter = new_filter
+                    self._last_ids = last_ids
+                    self._stale = 0
+                # Force a catch-up so slugs created during the build are added
+                self._data_versions = [None] * len(self._conns)
+                self._catch_up()
+                self.ready = True
+            self.builds += 1
+            self.last_build_seconds = time.perf_counter() - start
+            logger.info(
+                f"Built slug filter with {new_filter.count} slugs in {self.last_build_seconds:.3f}s "
+                f"({new_filter.memory_bytes} bytes, estimated FP rate {new_filter.estimated_fp_rate():.4%})"
+            )
+        except Exception as e:
+            logger.error(f"Failed to build slug filter: {e}")
+        finally:
+            self._rebuilding = False
+
+    def load(self) -> bool:
+        """Load a filter saved by save() and catch up with newer rows."""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, "rb") as f:
+                header = f.read(_FILE_HEADER.size)
+                magic, version, num_bits, num_hashes, count, capacity, stale, shards = _FILE_HEADER.unpack(header)
+                if magic != _FILE_MAGIC or version != _FILE_VERSION or shards != len(self._conns):
+                    return False
+                last_ids = [_SHARD_ID.unpack(f.read(_SHARD_ID.size))[0] for _ in range(shards)]
+                bits = bytearray(f.read())
+            if len(bits) != (num_bits + 7) // 8:
+                return False
+            for shard, last_id in enumerate(last_ids):
+                with db.get_db_connection(shard) as conn:
+                    max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM urls").fetchone()[0]
+                if max_id < last_id:
+                    # The file belongs to a different database
+                    return False
+            loaded = BloomFilter(capacity, self.fp_rate)
+            loaded.num_bits, loaded.num_hashes, loaded.bits, loaded.count = num_bits, num_hashes, bits, count
+            with self._sync_lock:
+                with self._lock:
+                    self._filter = loaded
+                    self._last_ids = last_ids
+                    self._stale = stale
+                self._data_versions = [None] * len(self._conns)
+                self._catch_up()
+                self.ready = True
+            logger.info(f"Loaded slug filter with {self._filter.count} slugs from {self.path}")
+            return True
+        except (OSError, struct.error, sqlite3.Error) as e:
+            logger.error(f"Failed to load slug filter from {self.path}: {e}")
+            return False
+
+    def save(self) -> None:
+        """Write the filter to disk atomically for a fast warm start."""
+        if not self.path or not self.ready:
+            return
+        with self._lock:
+            bloom = self._filter
+            header = _FILE_HEADER.pack(_FILE_MAGIC, _FILE_VERSION, bloom.num_bits, bloom.num_hashes,
+                                       bloom.count, bloom.capacity, self._stale, len(self._last_ids))
+            last_ids = b"".join(_SHARD_ID.pack(last_id) for last_id in self._last_ids)
+            data = bytes(bloom.bits)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.write(last_ids)
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def start(self) -> None:
+        """Load the saved filter, or build one in the background."""
+        if self.load():
+            return
+        self._rebuilding = True
+        threading.Thread(target=self.build, name="slug-filter-build", daemon=True).start()
+
+    def close(self) -> None:
+        """Save the filter and close its connection."""
+        try:
+            self.save()
+        except OSError as e:
+            logger.error(f"Failed to save slug filter to {self.path}: {e}")
+        with self._sync_lock:
+            for shard, conn in enumerate(self._conns):
+                if conn is not None:
+                    conn.close()
+                    self._conns[shard] = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Return memory footprint, estimated and observed false-positive rates."""
+        bloom = self._filter
+        negatives = self.false_positives + self.definite_misses
+        return {
+            "ready": self.ready,
+            "slugs": bloom.count,
+            "stale": self._stale,
+            "capacity": bloom.capacity,
+            "bits": bloom.num_bits,
+            "hashes": bloom.num_hashes,
+            "memory_bytes": bloom.memory_bytes,
+            "estimated_fp_rate": bloom.estimated_fp_rate(),
+            "definite_misses": self.definite_misses,
+            "false_positives": self.false_positives,
+            "observed_fp_rate": self.false_positives / negatives if negatives else 0.0,
+            "syncs": self.syncs,
+            "builds": self.builds,
+            "last_build_seconds": self.last_build_seconds,
+        }
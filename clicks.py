@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import analytics
+import db
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Click increments that have been counted in memory but not yet written to SQLite
+pending_clicks: Dict[str, int] = {}
+# The same clicks keyed by (slug, minute bucket) for time-series analytics
+pending_buckets: Dict[Tuple[str, int], int] = {}
+pending_total = 0
+# Clicks taken by a flush that has not committed yet; readers keep counting them until it does
+inflight_clicks: Dict[str, int] = {}
+inflight_buckets: Dict[Tuple[str, int], int] = {}
+pending_lock = threading.Lock()
+
+_flush_event = threading.Event()
+_stop_event = threading.Event()
+_flush_thread: Optional[threading.Thread] = None
+
+
+def record_click(slug: str) -> None:
+    """Count a click for the slug in memory; it is persisted by the next flush."""
+    global pending_total
+    bucket = (slug, analytics.bucket_start(time.time(), "minute"))
+    with pending_lock:
+        pending_clicks[slug] = pending_clicks.get(slug, 0) + 1
+        pending_buckets[bucket] = pending_buckets.get(bucket, 0) + 1
+        pending_total += 1
+        threshold_reached = pending_total >= config.CLICK_FLUSH_THRESHOLD
+    if threshold_reached:
+        # Wake the flusher instead of writing on the request path
+        _flush_event.set()
+
+
+def get_pending_clicks(slug: str) -> int:
+    """Return the number of clicks for the slug that have not been flushed yet."""
+    with pending_lock:
+        return pending_clicks.get(slug, 0) + inflight_clicks.get(slug, 0)
+
+
+def get_pending_buckets(slug: str) -> Dict[int, int]:
+    """Return unflushed clicks for the slug per minute bucket."""
+    minutes: Dict[int, int] = {}
+    with pending_lock:
+        for buckets in (pending_buckets, inflight_buckets):
+            for (bucket_slug, minute), count in buckets.items():
+                if bucket_slug == slug:
+                    minutes[minute] = minutes.get(minute, 0) + count
+    return minutes
+
+
+def discard_pending_clicks(slug: str) -> None:
+    """Drop unflushed clicks for a slug, e.g. after the URL has been deleted."""
+    global pending_total
+    with pending_lock:
+        pending_total -= pending_clicks.pop(slug, 0)
+        inflight_clicks.pop(slug, None)
+        for buckets in (pending_buckets, inflight_buckets):
+            for bucket in [bucket for bucket in buckets if bucket[0] == slug]:
+                del buckets[bucket]
+
+
+def _subtract(counts: Dict[Any, int], key: Any, count: int) -> None:
+    remaining = counts.get(key, 0) - count
+    if remaining > 0:
+        counts[key] = remaining
+    else:
+        counts.pop(key, None)
+
+
+def _settle(batch: Dict[str, int], buckets: Dict[Tuple[str, int], int], committed: bool) -> None:
+    """
+    Stop counting a flushed batch as in flight. A batch that failed to commit
+    is put back so it is retried on the next flush, except for slugs whose
+    clicks were discarded in the meantime.
+    """
+    global pending_total
+    with pending_lock:
+        for slug, count in batch.items():
+            if not committed and slug in inflight_clicks:
+                pending_clicks[slug] = pending_clicks.get(slug, 0) + count
+                pending_total += count
+            _subtract(inflight_clicks, slug, count)
+        for bucket, count in buckets.items():
+            if not committed and bucket in inflight_buckets:
+                pending_buckets[bucket] = pending_buckets.get(bucket, 0) + count
+            _subtract(inflight_buckets, bucket, count)
+
+
+def _flush_shard(shard: int, batch: Dict[str, int], buckets: Dict[Tuple[str, int], int]) -> None:
+    """Write the click increments of one shard in a single transaction."""
+    with db.get_db_connection(shard) as conn:
+        # IMMEDIATE keeps the compactor from rolling up minutes between reading its watermark and writing
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "UPDATE urls SET clicks = clicks + ? WHERE slug = ?",
+                [(count, slug) for slug, count in batch.items()]
+            )
+            if config.ANALYTICS_ENABLED:
+                analytics.record_buckets(conn, [(slug, minute, count) for (slug, minute), count in buckets.items()])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def flush_clicks() -> int:
+    """
+    Write all pending click increments to the database, one transaction per
+    shard. Until a shard commits, its clicks are still reported as pending.
+    """
+    global pending_clicks, pending_buckets, pending_total
+    with pending_lock:
+        if not pending_clicks:
+            return 0
+        batch, pending_clicks = pending_clicks, {}
+        buckets, pending_buckets = pending_buckets, {}
+        pending_total = 0
+        for slug, count in batch.items():
+            inflight_clicks[slug] = inflight_clicks.get(slug, 0) + count
+        for bucket, count in buckets.items():
+            inflight_buckets[bucket] = inflight_buckets.get(bucket, 0) + count
+
+    shards = {slug: db.shard_for_slug(slug) for slug in batch}
+    shard_batches: Dict[int, Dict[str, int]] = {}
+    shard_bucket_batches: Dict[int, Dict[Tuple[str, int], int]] = {}
+    for slug, count in batch.items():
+        shard_batches.setdefault(shards[slug], {})[slug] = count
+    for bucket, count in buckets.items():
+        shard_bucket_batches.setdefault(shards[bucket[0]], {})[bucket] = count
+    flushed = 0
+    for shard, shard_batch in shard_batches.items():
+        shard_buckets = shard_bucket_batches.get(shard, {})
+        try:
+            _flush_shard(shard, shard_batch, shard_buckets)
+            _settle(shard_batch, shard_buckets, committed=True)
+            flushed += sum(shard_batch.values())
+        except Exception as e:
+            _settle(shard_batch, shard_buckets, committed=False)
+            logger.error(f"Error flushing {len(shard_batch)} click counters to shard {shard}: {e}")
+    return flushed
+
+
+def _flush_loop() -> None:
+    """Flush pending clicks every interval, or earlier when the size threshold is hit."""
+    while not _stop_event.is_set():
+        _flush_event.wait(config.CLICK_FLUSH_INTERVAL)
+        _flush_event.clear()
+        flush_clicks()
+
+
+def start_click_flusher() -> None:
+    """Start the background thread that periodically flushes click counts."""
+    global _flush_thread
+    if _flush_thread is not None and _flush_thread.is_alive():
+        return
+    _stop_event.clear()
+    _flush_thread = threading.Thread(target=_flush_loop, name="click-flusher", daemon=True)
+    _flush_thread.start()
+
+
+def stop_click_flusher() -> None:
+    """Stop the background flusher and write out any remaining clicks."""
+    global _flush_thread
+    _stop_event.set()
+    _flush_event.set()
+    if _flush_thread is not None:
+        _flush_thread.join(timeout=config.CLICK_FLUSH_INTERVAL + config.DATABASE_TIMEOUT)
+        _flush_thread = None
+    flushed = flush_clicks()
+    if flushed:
+        logger.info(f"Flushed {flushed} pending clicks on shutdown")
@@ -0,0 +1,134 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import db
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+def log_invalidations(conn: sqlite3.Connection, slugs: Iterable[str]) -> None:
+    """
+    Record changed slugs in the invalidation log so other workers drop them from
+    their caches. Call inside the transaction that changes the rows.
+    """
+    if config.COHERENCE_ENABLED:
+        conn.executemany("INSERT INTO cache_invalidations (slug) VALUES (?)", ((slug,) for slug in slugs))
+
+
+class CacheCoherence:
+    """
+    Keeps per-process caches coherent across worker processes.
+    Every create and delete appends the slug to the cache_invalidations table
+    in the same transaction. Each worker polls PRAGMA data_version on its own
+    connection, which changes whenever another connection commits, and only
+    then reads log entries newer than the last one it applied. Stale entries
+    are therefore dropped within one poll interval. Each shard keeps its own
+    log, written in the same transaction as its rows, and is polled separately.
+    on_invalidate receives the shard, the log entry id and the slug.
+    """
+
+    def __init__(self, on_invalidate: Callable[[int, int, str], None], on_reset: Callable[[], None]) -> None:
+        self.on_invalidate = on_invalidate
+        self.on_reset = on_reset
+        self._conns: List[Optional[sqlite3.Connection]] = [None] * db.shard_count()
+        self._data_versions: List[Optional[int]] = [None] * db.shard_count()
+        self._last_ids = [0] * db.shard_count()
+        self._last_prune = 0.0
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Statistics
+        self.polls = 0
+        self.invalidations = 0
+        self.resets = 0
+
+    def _connection(self, shard: int) -> sqlite3.Connection:
+        if self._conns[shard] is None:
+            path = db.shard_paths(config.DATABASE_FILE, db.shard_count())[shard]
+            self._conns[shard] = sqlite3.connect(path, timeout=config.DATABASE_TIMEOUT,
+                                                 isolation_level=None, check_same_thread=False)
+        return self._conns[shard]
+
+    def poll(self) -> int:
+        """Apply invalidations logged since the last poll; returns how many were applied."""
+        self.polls += 1
+        return sum(self._poll_shard(shard) for shard in range(len(self._conns)))
+
+    def _poll_shard(self, shard: int) -> int:
+        conn = self._connection(shard)
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_versions[shard]:
+            return 0
+        self._data_versions[shard] = version
+
+        last_id = self._last_ids[shard]
+        oldest = conn.execute("SELECT MIN(id) FROM cache_invalidations").fetchone()[0]
+        if oldest is not None and oldest > last_id + 1 and last_id:
+            # Entries we never saw were pruned, so anything cached may be stale
+            logger.warning(f"Cache invalidation log of shard {shard} was pruned past this worker's position; clearing caches")
+            self.on_reset()
+            self.resets += 1
+
+        rows = conn.execute(
+            "SELECT id, slug FROM cache_invalidations WHERE id > ? ORDER BY id",
+            (last_id,)
+        ).fetchall()
+        for row_id, slug in rows:
+            self.on_invalidate(shard, row_id, slug)
+            self._last_ids[shard] = row_id
+        self.invalidations += len(rows)
+        return len(rows)
+
+    def prune(self) -> None:
+        """Delete log entries older than the retention period."""
+        for shard in range(len(self._conns)):
+            self._connection(shard).execute(
+                "DELETE FROM cache_invalidations WHERE created_at < datetime('now', ?)",
+                (f"-{int(config.COHERENCE_LOG_RETENTION)} seconds",)
+            )
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(config.COHERENCE_POLL_INTERVAL):
+            try:
+                self.poll()
+                if time.monotonic() - self._last_prune > config.COHERENCE_LOG_RETENTION / 10:
+                    self._last_prune = time.monotonic()
+                    self.prune()
+            except sqlite3.Error as e:
+                logger.error(f"Error polling cache invalidations: {e}")
+
+    def start(self) -> None:
+        """Start polling from the current end of the log."""
+        for shard in range(len(self._conns)):
+            conn = self._connection(shard)
+            self._data_versions[shard] = conn.execute("PRAGMA data_version").fetchone()[0]
+            self._last_ids[shard] = conn.execute("SELECT COALESCE(MAX(id), 0) FROM cache_invalidations").fetchone()[0]
+        self._last_prune = time.monotonic()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-coherence", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop polling and close the connection."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=config.COHERENCE_POLL_INTERVAL + config.DATABASE_TIMEOUT)
+            self._thread = None
+        for shard, conn in enumerate(self._conns):
+            if conn is not None:
+                conn.close()
+                self._conns[shard] = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Return poll and invalidation counters."""
+        return {
+            "enabled": self._thread is not None,
+            "poll_interval": config.COHERENCE_POLL_INTERVAL,
+            "last_applied_ids": list(self._last_ids),
+            "polls": self.polls,
+            "invalidations": self.invalidations,
+            "resets": self.resets,
+        }
@@ -10,15 +10,101 @@ class Config:
     
     # Database configuration
     DATABASE_FILE: str = os.getenv("DATABASE_FILE", "urls.db")
+    # Number of SQLite files the URL store is split across; shard 0 is DATABASE_FILE
+    SHARD_COUNT: int = int(os.getenv("SHARD_COUNT", "1"))
     DATABASE_TIMEOUT: int = int(os.getenv("DATABASE_TIMEOUT", "5"))
+    # Database threads per shard; each shard's pool also has room for the background threads
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "8"))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+    DB_STATEMENT_CACHE_SIZE: int = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "128"))
+    DB_JOURNAL_MODE: str = os.getenv("DB_JOURNAL_MODE", "WAL")
+    DB_SYNCHRONOUS: str = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+    DB_MMAP_SIZE: int = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+    # Negative values are in KiB, positive values in pages (see PRAGMA cache_size)
+    DB_CACHE_SIZE: int = int(os.getenv("DB_CACHE_SIZE", "-65536"))
     
     # Application settings
+    STATIC_DIR: str = os.getenv("STATIC_DIR", "static")
     RELOAD: bool = os.getenv("RELOAD", "true").lower() == "true"
     DEBUG: bool = os.getenv("DEBUG", "false").lower() == "true"
+    # Seconds startup may spend creating the schema and filling the slug pool
+    STARTUP_TIMEOUT: float = float(os.getenv("STARTUP_TIMEOUT", "10"))
     
     # URL shortening settings
     SLUG_LENGTH: int = int(os.getenv("SLUG_LENGTH", "4"))
+    # "counter" (base62 counter, optionally scrambled) or "random"
+    SLUG_ALLOCATOR: str = os.getenv("SLUG_ALLOCATOR", "counter")
+    SLUG_SCRAMBLE: bool = os.getenv("SLUG_SCRAMBLE", "true").lower() == "true"
+    # Shared by all workers; generated and stored in the database when empty
+    SLUG_SCRAMBLE_KEY: str = os.getenv("SLUG_SCRAMBLE_KEY", "")
+    SLUG_BLOCK_SIZE: int = int(os.getenv("SLUG_BLOCK_SIZE", "1000"))
+    SLUG_MAX_COLLISION_RATE: float = float(os.getenv("SLUG_MAX_COLLISION_RATE", "0.1"))
+    # max-age for permanent (301/308) redirects created without an explicit cache_max_age
+    REDIRECT_DEFAULT_MAX_AGE: int = int(os.getenv("REDIRECT_DEFAULT_MAX_AGE", "86400"))
     MAX_CUSTOM_SLUG_LENGTH: int = int(os.getenv("MAX_CUSTOM_SLUG_LENGTH", "32"))
+    # Return the existing slug when a URL without a custom slug was already shortened
+    DEDUP_ENABLED: bool = os.getenv("DEDUP_ENABLED", "false").lower() == "true"
+    DEDUP_BACKFILL_BATCH_SIZE: int = int(os.getenv("DEDUP_BACKFILL_BATCH_SIZE", "1000"))
+    DEDUP_BACKFILL_PAUSE: float = float(os.getenv("DEDUP_BACKFILL_PAUSE", "0.01"))
+    BATCH_MAX_SIZE: int = int(os.getenv("BATCH_MAX_SIZE", "10000"))
+    
+    # URL listing settings
+    URL_LIST_PAGE_SIZE: int = int(os.getenv("URL_LIST_PAGE_SIZE", "100"))
+    URL_LIST_MAX_PAGE_SIZE: int = int(os.getenv("URL_LIST_MAX_PAGE_SIZE", "1000"))
+    
+    # Redirect cache settings
+    CACHE_MAX_SIZE: int = int(os.getenv("CACHE_MAX_SIZE", "10000"))
+    CACHE_TTL: float = float(os.getenv("CACHE_TTL", "300"))
+    NEGATIVE_CACHE_MAX_SIZE: int = int(os.getenv("NEGATIVE_CACHE_MAX_SIZE", "10000"))
+    NEGATIVE_CACHE_TTL: float = float(os.getenv("NEGATIVE_CACHE_TTL", "5"))
+    # Serve cached redirects from a raw ASGI middleware before routing
+    REDIRECT_FAST_PATH: bool = os.getenv("REDIRECT_FAST_PATH", "true").lower() == "true"
+    # Most clicked links loaded into the redirect cache on startup; 0 disables warmup
+    CACHE_WARMUP_SIZE: int = int(os.getenv("CACHE_WARMUP_SIZE", "1000"))
+    CACHE_WARMUP_TIMEOUT: float = float(os.getenv("CACHE_WARMUP_TIMEOUT", "2"))
+    
+    # Slug existence filter settings
+    SLUG_FILTER_ENABLED: bool = os.getenv("SLUG_FILTER_ENABLED", "true").lower() == "true"
+    SLUG_FILTER_CAPACITY: int = int(os.getenv("SLUG_FILTER_CAPACITY", "1000000"))
+    SLUG_FILTER_FP_RATE: float = float(os.getenv("SLUG_FILTER_FP_RATE", "0.01"))
+    SLUG_FILTER_MAX_STALE_RATIO: float = float(os.getenv("SLUG_FILTER_MAX_STALE_RATIO", "0.2"))
+    # Optional path where the filter is saved on shutdown for a fast warm start
+    SLUG_FILTER_FILE: str = os.getenv("SLUG_FILTER_FILE", "")
+    
+    # Click analytics settings
+    ANALYTICS_ENABLED: bool = os.getenv("ANALYTICS_ENABLED", "true").lower() == "true"
+    ANALYTICS_COMPACT_INTERVAL: float = float(os.getenv("ANALYTICS_COMPACT_INTERVAL", "60"))
+    # Buckets newer than this many seconds are not rolled up yet
+    ANALYTICS_COMPACT_GRACE: float = float(os.getenv("ANALYTICS_COMPACT_GRACE", "300"))
+    ANALYTICS_MINUTE_RETENTION_HOURS: float = float(os.getenv("ANALYTICS_MINUTE_RETENTION_HOURS", "48"))
+    ANALYTICS_HOUR_RETENTION_DAYS: float = float(os.getenv("ANALYTICS_HOUR_RETENTION_DAYS", "90"))
+    # 0 keeps daily buckets forever
+    ANALYTICS_DAY_RETENTION_DAYS: float = float(os.getenv("ANALYTICS_DAY_RETENTION_DAYS", "0"))
+    
+    # Cross-worker cache coherence settings
+    COHERENCE_ENABLED: bool = os.getenv("COHERENCE_ENABLED", "true").lower() == "true"
+    COHERENCE_POLL_INTERVAL: float = float(os.getenv("COHERENCE_POLL_INTERVAL", "0.5"))
+    COHERENCE_LOG_RETENTION: float = float(os.getenv("COHERENCE_LOG_RETENTION", "3600"))
+    
+    # Memory-mapped redirect snapshot written by tools/export_snapshot.py; empty disables it
+    SNAPSHOT_FILE: str = os.getenv("SNAPSHOT_FILE", "")
+    SNAPSHOT_RELOAD_INTERVAL: float = float(os.getenv("SNAPSHOT_RELOAD_INTERVAL", "5"))
+    
+    # Link expiry settings; expired links stop redirecting at once and are deleted by the sweeper
+    EXPIRY_ENABLED: bool = os.getenv("EXPIRY_ENABLED", "true").lower() == "true"
+    EXPIRY_SWEEP_INTERVAL: float = float(os.getenv("EXPIRY_SWEEP_INTERVAL", "60"))
+    EXPIRY_BATCH_SIZE: int = int(os.getenv("EXPIRY_BATCH_SIZE", "500"))
+    # Pause between batches so other writers get the write lock
+    EXPIRY_BATCH_PAUSE: float = float(os.getenv("EXPIRY_BATCH_PAUSE", "0.05"))
+    # Free pages returned to the filesystem per shard after a sweep; 0 disables
+    EXPIRY_VACUUM_PAGES: int = int(os.getenv("EXPIRY_VACUUM_PAGES", "1000"))
+    
+    # Metrics settings
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    
+    # Click counting settings
+    CLICK_FLUSH_INTERVAL: float = float(os.getenv("CLICK_FLUSH_INTERVAL", "1.0"))
+    CLICK_FLUSH_THRESHOLD: int = int(os.getenv("CLICK_FLUSH_THRESHOLD", "1000"))
     
     @classmethod
     def load_from_env(cls) -> None:
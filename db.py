@@ -1,42 +1,346 @@
+import asyncio
+import functools
+import hashlib
+import os
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
-from typing import Generator
+from typing import Any, Callable, ContextManager, Dict, Generator, Iterable, List, Optional, TypeVar
 from config import config
+import metrics
+
+T = TypeVar("T")
+
+
+class ConnectionPool:
+    """Bounded pool of reusable SQLite connections configured once on creation."""
+
+    def __init__(self, database: str, size: int, timeout: float) -> None:
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        # Checkout statistics
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection and apply the configured pragmas."""
+        conn = sqlite3.connect(
+            self.database,
+            timeout=config.DATABASE_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=config.DB_STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row
+        # Only takes effect on a new database, before the journal mode is written; existing ones need a VACUUM
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute(f"PRAGMA journal_mode = {config.DB_JOURNAL_MODE}")
+        conn.execute(f"PRAGMA synchronous = {config.DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA mmap_size = {int(config.DB_MMAP_SIZE)}")
+        conn.execute(f"PRAGMA cache_size = {int(config.DB_CACHE_SIZE)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Check out a connection, opening a new one while below the pool size."""
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._closed:
+                    raise sqlite3.OperationalError("connection pool is closed")
+                if len(self._connections) < self.size:
+                    conn = self._connect()
+                    self._connections.append(conn)
+            if conn is None:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self.timeouts += 1
+                    raise sqlite3.OperationalError(
+                        f"timed out after {self.timeout}s waiting for a pooled connection"
+                    )
+                with self._lock:
+                    self.waits += 1
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """Return a connection to the pool, rolling back any open transaction."""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if self._closed:
+                conn.close()
+                return
+        self._idle.put(conn)
+
+    def close(self) -> None:
+        """Close all connections; connections still checked out are closed on release."""
+        with self._lock:
+            self._closed = True
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Return pool size and checkout wait statistics."""
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": len(self._connections),
+                "idle": self._idle.qsize(),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "total_wait_seconds": self.total_wait,
+                "max_wait_seconds": self.max_wait,
+                "avg_wait_seconds": self.total_wait / self.checkouts if self.checkouts else 0.0,
+            }
+
+
+def shard_paths(database: str, count: int) -> List[str]:
+    """Return the file of every shard; shard 0 is the database file itself."""
+    root, ext = os.path.splitext(database)
+    return [database] + [f"{root}.shard{index}{ext}" for index in range(1, count)]
+
+def shard_count() -> int:
+    """Return the configured number of shards."""
+    return max(1, config.SHARD_COUNT)
+
+def shard_for_slug(slug: str, count: Optional[int] = None) -> int:
+    """Return the shard that stores a slug, using a hash that is stable across processes."""
+    count = shard_count() if count is None else count
+    if count == 1:
+        return 0
+    digest = hashlib.blake2b(slug.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+def group_by_shard(slugs: Iterable[str]) -> Dict[int, List[str]]:
+    """Group slugs by the shard that stores them."""
+    groups: Dict[int, List[str]] = {}
+    for slug in slugs:
+        groups.setdefault(shard_for_slug(slug), []).append(slug)
+    return groups
+
+_pools: Dict[int, ConnectionPool] = {}
+_pool_lock = threading.Lock()
+
+# Threads that check out pooled connections outside the executor: the click flusher,
+# analytics compactor, expiry sweeper, dedup backfill, slug filter build and snapshot loader
+BACKGROUND_CONNECTIONS = 6
+
+def executor_threads() -> int:
+    """Return the number of threads that run database work for requests."""
+    return config.DB_POOL_SIZE * shard_count()
+
+def pool_size() -> int:
+    """
+    Return the connection limit of each shard's pool. Every executor thread may
+    work on the same shard while every background thread holds a connection, so
+    nobody has to wait for a connection; they are only opened when needed.
+    """
+    return executor_threads() + BACKGROUND_CONNECTIONS
+
+def get_pool(shard: int = 0) -> ConnectionPool:
+    """Return the process-wide connection pool of a shard, creating it on first use."""
+    pool = _pools.get(shard)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(shard)
+            if pool is None:
+                database = shard_paths(config.DATABASE_FILE, shard_count())[shard]
+                pool = _pools[shard] = ConnectionPool(database, pool_size(), config.DB_POOL_TIMEOUT)
+    return pool
+
+def close_pool() -> None:
+    """Close every connection pool; new ones are created on next use."""
+    with _pool_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the thread pool that runs database work off the event loop."""
+    global _executor
+    if _executor is None:
+        with _pool_lock:
+            if _executor is None:
+                # Pools are sized for every executor thread plus the background threads, see pool_size()
+                _executor = ThreadPoolExecutor(max_workers=executor_threads(), thread_name_prefix="db")
+    return _executor
+
+def shutdown_executor() -> None:
+    """Wait for queued database work to finish and stop the worker threads."""
+    global _executor
+    with _pool_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+def _timed_call(func: Callable[..., T], submitted: float, args: Any, kwargs: Any) -> T:
+    """Run func and record how long it queued for a thread and how long it ran."""
+    name = getattr(func, "__name__", "unknown")
+    start = time.perf_counter()
+    metrics.db_executor_wait.observe(start - submitted, name)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        metrics.db_call_duration.observe(time.perf_counter() - start, name)
+
+async def run_db(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking database function in the database thread pool and await its result."""
+    loop = asyncio.get_running_loop()
+    if not config.METRICS_ENABLED:
+        return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+    return await loop.run_in_executor(get_executor(), _timed_call, func, time.perf_counter(), args, kwargs)
 
 @contextmanager
-def get_db_connection() -> Generator[sqlite3.Connection, None, None]:
-    """Returns a connection to the SQLite database with proper error handling."""
+def get_db_connection(shard: int = 0) -> Generator[sqlite3.Connection, None, None]:
+    """
+    Returns a pooled connection to the SQLite database with proper error handling.
+    Shard 0 also holds state that is not sharded, such as the slug counters.
+    """
+    pool = None
     conn = None
+    start = time.perf_counter()
+    acquired = start
     try:
-        conn = sqlite3.connect(config.DATABASE_FILE, timeout=config.DATABASE_TIMEOUT, isolation_level=None)
-        conn.row_factory = sqlite3.Row
+        pool = get_pool(shard)
+        conn = pool.acquire()
+        acquired = time.perf_counter()
+        metrics.db_checkout_wait.observe(acquired - start)
         yield conn
     except sqlite3.Error as e:
+        metrics.db_errors.inc()
         # It's better to raise a custom exception type here.
         raise Exception(f"Database error: {e}")
     finally:
         if conn:
-            conn.close()
+            metrics.db_connection_hold.observe(time.perf_counter() - acquired)
+            pool.release(conn)
+
+def migrate_urls_table(conn: sqlite3.Connection) -> None:
+    """Add columns introduced after the urls table was first created."""
+    # The write lock keeps several workers from adding the same column at once
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(urls)")}
+        if "redirect_status" not in columns:
+            conn.execute("ALTER TABLE urls ADD COLUMN redirect_status INTEGER NOT NULL DEFAULT 307")
+        if "redirect_max_age" not in columns:
+            conn.execute("ALTER TABLE urls ADD COLUMN redirect_max_age INTEGER NOT NULL DEFAULT 0")
+        if "url_hash" not in columns:
+            conn.execute("ALTER TABLE urls ADD COLUMN url_hash INTEGER")
+        if "expires_at" not in columns:
+            conn.execute("ALTER TABLE urls ADD COLUMN expires_at INTEGER")
+        if "max_clicks" not in columns:
+            conn.execute("ALTER TABLE urls ADD COLUMN max_clicks INTEGER")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def get_slug_connection(slug: str) -> ContextManager[sqlite3.Connection]:
+    """Returns a pooled connection to the shard that stores the slug."""
+    return get_db_connection(shard_for_slug(slug))
 
 def init_db() -> None:
-    """Initializes the database and creates the 'urls' table if it doesn't exist."""
+    """Initializes every shard and creates the 'urls' table if it doesn't exist."""
+    for shard in range(shard_count()):
+        with get_db_connection(shard) as conn:
+            init_shard_schema(conn)
     with get_db_connection() as conn:
+        # Slug allocator state shared by all worker processes
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS slug_counters (
+                length INTEGER PRIMARY KEY,
+                next_value INTEGER NOT NULL
+            )
+        """)
         conn.execute("""
-            CREATE TABLE IF NOT EXISTS urls (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                slug TEXT UNIQUE NOT NULL,
-                long_url TEXT NOT NULL,
-                clicks INTEGER NOT NULL DEFAULT 0,
-                created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            CREATE TABLE IF NOT EXISTS slug_allocator_state (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
             )
         """)
-        
-        # Create indexes for performance optimization
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_urls_slug ON urls(slug);")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_urls_created_at ON urls(created_at DESC);")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_urls_clicks ON urls(clicks DESC);")
-
-# NOTE: Calling init_db() here is convenient for simple applications.
-# For more complex applications, it's better to manage database
-# initialization explicitly, for example, in an application startup event.
-init_db()
+
+def init_shard_schema(conn: sqlite3.Connection) -> None:
+    """Create the tables every shard holds: URLs, their invalidation log and click buckets."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS urls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            slug TEXT UNIQUE NOT NULL,
+            long_url TEXT NOT NULL,
+            clicks INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            redirect_status INTEGER NOT NULL DEFAULT 307,
+            redirect_max_age INTEGER NOT NULL DEFAULT 0,
+            url_hash INTEGER,
+            expires_at INTEGER,
+            max_clicks INTEGER
+        )
+    """)
+    migrate_urls_table(conn)
+
+    # Create indexes for performance optimization
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_urls_slug ON urls(slug);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_urls_created_at ON urls(created_at DESC);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_urls_clicks ON urls(clicks DESC);")
+    # Hashes are only stored in dedup mode, so the partial index costs nothing otherwise
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_urls_url_hash ON urls(url_hash) WHERE url_hash IS NOT NULL;")
+    # Only links with an expiry (unix seconds) or a click limit are indexed for the expiry sweeper
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_urls_expires_at ON urls(expires_at) WHERE expires_at IS NOT NULL;")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_urls_max_clicks ON urls(max_clicks) WHERE max_clicks IS NOT NULL;")
+
+    # Log of changed slugs that other worker processes must drop from their caches
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cache_invalidations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            slug TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_invalidations_created_at ON cache_invalidations(created_at);")
+
+    # Time-bucketed click counts; buckets are unix timestamps of the bucket start
+    for table in ("clicks_minute", "clicks_hour", "clicks_day"):
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                slug TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                clicks INTEGER NOT NULL,
+                PRIMARY KEY (slug, bucket)
+            ) WITHOUT ROWID
+        """)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table}(bucket);")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS analytics_watermarks (
+            granularity TEXT PRIMARY KEY,
+            compacted_until INTEGER NOT NULL
+        )
+    """)
@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+import db
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# SQLite's default limit on host parameters is 999 on older builds
+QUERY_CHUNK_SIZE = 500
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# (normalized long URL, redirect status, max-age): links are only shared when all match
+DedupKey = Tuple[str, int, int]
+
+_stop_event = threading.Event()
+_backfill_thread: Optional[threading.Thread] = None
+
+
+def normalize_url(long_url: str) -> str:
+    """Normalize the parts of a URL that do not change where it points."""
+    parts = urlsplit(long_url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if ":" in host:
+        host = f"[{host}]"
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    userinfo = parts.netloc.rpartition("@")[0]
+    netloc = f"{userinfo}@{host}" if userinfo else host
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, parts.fragment))
+
+
+def url_hash(long_url: str) -> int:
+    """Return the signed 64-bit hash of the normalized URL stored in urls.url_hash."""
+    digest = hashlib.blake2b(normalize_url(long_url).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def stored_hash(long_url: str) -> Optional[int]:
+    """Return the hash to store with a new URL, or None when dedup is off."""
+    return url_hash(long_url) if config.DEDUP_ENABLED else None
+
+
+def find_existing(keys: Iterable[DedupKey]) -> Dict[DedupKey, dict]:
+    """
+    Look up links that already point at the given URLs with the same redirect
+    policy. Candidates are found through the url_hash index on every shard and
+    then compared on the normalized URL, so hash collisions never match. Links
+    with an expiry or a click limit are never matched.
+    """
+    wanted: Dict[int, List[DedupKey]] = {}
+    for key in keys:
+        wanted.setdefault(url_hash(key[0]), []).append(key)
+    hashes = list(wanted)
+    found: Dict[DedupKey, dict] = {}
+    for shard in range(db.shard_count()):
+        with db.get_db_connection(shard) as conn:
+            for start in range(0, len(hashes), QUERY_CHUNK_SIZE):
+                chunk = hashes[start:start + QUERY_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    "SELECT slug, long_url, clicks, created_at, redirect_status, redirect_max_age, url_hash "
+                    f"FROM urls WHERE url_hash IN ({placeholders}) AND expires_at IS NULL AND max_clicks IS NULL "
+                    "ORDER BY id",
+                    chunk
+                ).fetchall()
+                for row in rows:
+                    key = (normalize_url(row["long_url"]), row["redirect_status"], row["redirect_max_age"])
+                    for wanted_key in wanted[row["url_hash"]]:
+                        if (normalize_url(wanted_key[0]), wanted_key[1], wanted_key[2]) == key:
+                            found.setdefault(wanted_key, dict(row))
+    return found
+
+
+def backfill_url_hashes(batch_size: int = 1000, pause: float = 0.0,
+                        progress: Optional[Callable[[int, int], None]] = None) -> int:
+    """
+    Store url_hash for rows created before dedup was enabled. Each batch is a
+    short transaction, so the application can keep serving while this runs.
+    Returns the number of rows updated.
+    """
+    updated = 0
+    for shard in range(db.shard_count()):
+        last_id = 0
+        while not _stop_event.is_set():
+            with db.get_db_connection(shard) as conn:
+                rows = conn.execute(
+                    "SELECT id, long_url FROM urls WHERE url_hash IS NULL AND id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                conn.execute("BEGIN")
+                try:
+                    conn.executemany(
+                        "UPDATE urls SET url_hash = ? WHERE id = ?",
+                        [(url_hash(row["long_url"]), row["id"]) for row in rows]
+                    )
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            last_id = rows[-1]["id"]
+            updated += len(rows)
+            if progress:
+                progress(shard, updated)
+            if pause:
+                time.sleep(pause)
+    return updated
+
+
+def _backfill() -> None:
+    try:
+        start = time.perf_counter()
+        updated = backfill_url_hashes(config.DEDUP_BACKFILL_BATCH_SIZE, config.DEDUP_BACKFILL_PAUSE)
+        if updated:
+            logger.info(f"Backfilled URL hashes for {updated} rows in {time.perf_counter() - start:.1f}s")
+    except Exception as e:
+        logger.error(f"Error backfilling URL hashes: {e}")
+
+
+def start_backfill() -> None:
+    """Backfill missing URL hashes in a background thread."""
+    global _backfill_thread
+    if _backfill_thread is not None and _backfill_thread.is_alive():
+        return
+    _stop_event.clear()
+    _backfill_thread = threading.Thread(target=_backfill, name="url-hash-backfill", daemon=True)
+    _backfill_thread.start()
+
+
+def stop_backfill() -> None:
+    """Stop the background backfill after its current batch."""
+    global _backfill_thread
+    _stop_event.set()
+    if _backfill_thread is not None:
+        _backfill_thread.join(timeout=config.DATABASE_TIMEOUT)
+        _backfill_thread = None
@@ -0,0 +1,146 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import analytics
+import db
+import metrics
+from coherence import log_invalidations
+from config import config
+
+logger = logging.getLogger(__name__)
+
+_stop_event = threading.Event()
+_sweep_thread: Optional[threading.Thread] = None
+# Called with the slugs of every deleted batch, e.g. to drop them from this process's caches
+_on_removed: Optional[Callable[[List[str]], None]] = None
+
+# Statistics
+_sweeps = 0
+_removed = 0
+_vacuumed_pages = 0
+
+
+def delete_expired_batch(conn: sqlite3.Connection, now: int, limit: int) -> List[str]:
+    """
+    Delete up to limit links that expired or used up their clicks, with their
+    click buckets; call inside a transaction. Both lookups read partial indexes
+    that only hold links with an expiry or a click limit. Returns the slugs.
+    """
+    rows = conn.execute(
+        "SELECT id, slug FROM urls WHERE expires_at <= ? LIMIT ?", (now, limit)
+    ).fetchall()
+    if len(rows) < limit:
+        rows += conn.execute(
+            "SELECT id, slug FROM urls WHERE max_clicks IS NOT NULL AND clicks >= max_clicks LIMIT ?",
+            (limit - len(rows),)
+        ).fetchall()
+    # Links that both expired and used up their clicks are found twice
+    found = {row["id"]: row["slug"] for row in rows}
+    if not found:
+        return []
+    conn.execute(f"DELETE FROM urls WHERE id IN ({','.join('?' * len(found))})", list(found))
+    slugs = list(found.values())
+    for slug in slugs:
+        analytics.delete_slug_analytics(conn, slug)
+    # Other workers drop the slugs from their caches and snapshot overlays
+    log_invalidations(conn, slugs)
+    return slugs
+
+
+def reclaim_free_pages(conn: sqlite3.Connection, pages: int) -> int:
+    """Return up to pages free pages of an incremental auto-vacuum database to the filesystem."""
+    if pages <= 0 or conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if not before:
+        return 0
+    # executescript steps the pragma to completion; execute() would free a single page
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def sweep_shard(shard: int, now: int) -> int:
+    """
+    Delete the expired links of one shard in batches of EXPIRY_BATCH_SIZE, each
+    in its own short write transaction, then reclaim the freed pages. Returns
+    how many links were deleted.
+    """
+    global _removed, _vacuumed_pages
+    removed = 0
+    while True:
+        with db.get_db_connection(shard) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                slugs = delete_expired_batch(conn, now, config.EXPIRY_BATCH_SIZE)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if slugs and _on_removed is not None:
+            _on_removed(slugs)
+        removed += len(slugs)
+        _removed += len(slugs)
+        if len(slugs) < config.EXPIRY_BATCH_SIZE or _stop_event.wait(config.EXPIRY_BATCH_PAUSE):
+            break
+    if removed:
+        with db.get_db_connection(shard) as conn:
+            _vacuumed_pages += reclaim_free_pages(conn, config.EXPIRY_VACUUM_PAGES)
+    return removed
+
+
+def sweep(now: Optional[float] = None) -> int:
+    """Delete expired links on every shard; returns how many were deleted."""
+    global _sweeps
+    now = int(time.time() if now is None else now)
+    _sweeps += 1
+    return sum(sweep_shard(shard, now) for shard in range(db.shard_count()))
+
+
+def _sweep_loop() -> None:
+    while not _stop_event.wait(config.EXPIRY_SWEEP_INTERVAL):
+        try:
+            removed = sweep()
+            if removed:
+                logger.info(f"Deleted {removed} expired links")
+        except Exception as e:
+            logger.error(f"Error deleting expired links: {e}")
+
+
+def start_sweeper(on_removed: Optional[Callable[[List[str]], None]] = None) -> None:
+    """Start the background thread that deletes expired links."""
+    global _sweep_thread, _on_removed
+    if _sweep_thread is not None and _sweep_thread.is_alive():
+        return
+    _on_removed = on_removed
+    _stop_event.clear()
+    _sweep_thread = threading.Thread(target=_sweep_loop, name="expiry-sweeper", daemon=True)
+    _sweep_thread.start()
+
+
+def stop_sweeper() -> None:
+    """Stop the background sweeper thread."""
+    global _sweep_thread
+    _stop_event.set()
+    if _sweep_thread is not None:
+        _sweep_thread.join(timeout=config.DATABASE_TIMEOUT)
+        _sweep_thread = None
+
+
+def stats() -> Dict[str, Any]:
+    """Return sweep counters."""
+    return {
+        "enabled": _sweep_thread is not None,
+        "sweep_interval": config.EXPIRY_SWEEP_INTERVAL,
+        "sweeps": _sweeps,
+        "removed": _removed,
+        "vacuumed_pages": _vacuumed_pages,
+    }
+
+
+metrics.register_callback("url_shortener_expired_links_removed_total", "counter",
+                          "Expired links deleted by the sweeper", lambda: [((), _removed)])
+metrics.register_callback("url_shortener_expiry_vacuumed_pages_total", "counter",
+                          "Free pages returned to the filesystem after sweeps", lambda: [((), _vacuumed_pages)])
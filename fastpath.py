@@ -0,0 +1,102 @@
+import logging
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import unquote
+
+import clicks
+from config import config
+from routers.redirect import CachedRedirect, build_redirect, get_cached_url, redirect_to_long_url
+
+logger = logging.getLogger(__name__)
+
+# Status and raw headers of a redirect response
+ResponseHead = Tuple[int, List[Tuple[bytes, bytes]]]
+# Path of the redirect route, which matches everything no other route claims
+CATCH_ALL_PATH = "/{slug:path}"
+
+
+def _flatten_routes(routes: List[Any], prefix: str = "") -> Iterator[Tuple[str, Any]]:
+    """Yield (full path, route) for every route, descending into included routers."""
+    for route in routes:
+        included = getattr(route, "original_router", None)
+        if included is not None:
+            # Newer FastAPI versions keep included routers instead of copying their routes
+            context = getattr(route, "include_context", None)
+            yield from _flatten_routes(included.routes, prefix + getattr(context, "prefix", ""))
+            continue
+        path = getattr(route, "path", None)
+        if path is not None:
+            yield prefix + path, route
+
+
+class RedirectFastPath:
+    """
+    Raw ASGI middleware that answers redirects for cached slugs without routing.
+    A GET for a path that no other route can match is looked up in the redirect
+    cache; on a hit the click is recorded and the response is sent from header
+    bytes prebuilt by the redirect route's own response builder. Everything
+    else, including cache misses, goes to the application unchanged, so
+    reserved paths, 404 pages and errors behave exactly as before.
+    """
+
+    def __init__(self, app: Callable, routes: Callable[[], List[Any]]) -> None:
+        self.app = app
+        # Routes are read on the first request, once every route has been added
+        self._routes = routes
+        self._exact: Optional[Set[str]] = None
+        self._prefixes: Tuple[str, ...] = ()
+        self._catch_all_route: Any = None
+        self._head = lru_cache(maxsize=max(config.CACHE_MAX_SIZE, 1))(self._build_head)
+        self.hits = 0
+
+    def _load_routes(self) -> None:
+        """Collect the paths claimed by every route except the catch-all redirect."""
+        exact: Set[str] = set()
+        prefixes: List[str] = []
+        for path, route in _flatten_routes(self._routes()):
+            if getattr(route, "endpoint", None) is redirect_to_long_url and path == CATCH_ALL_PATH:
+                self._catch_all_route = route
+                continue
+            if "{" in path:
+                # Any path a parameterized route can match starts with its literal prefix
+                prefixes.append(path[:path.index("{")])
+            else:
+                exact.add(path)
+                if not hasattr(route, "endpoint"):
+                    # Mounted apps claim everything below them
+                    prefixes.append(path.rstrip("/") + "/")
+        if self._catch_all_route is None:
+            # Without the redirect route there is nothing to shortcut
+            prefixes = ["/"]
+        self._prefixes = tuple(prefixes)
+        self._exact = exact
+        logger.info(f"Redirect fast path skips {len(exact)} paths and {len(prefixes)} prefixes claimed by other routes")
+
+    def _build_head(self, redirect: CachedRedirect) -> ResponseHead:
+        response = build_redirect(redirect)
+        return response.status_code, response.raw_headers
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or scope["method"] != "GET" or scope.get("root_path"):
+            await self.app(scope, receive, send)
+            return
+        if self._exact is None:
+            self._load_routes()
+        path = scope["path"]
+        if path in self._exact or path.startswith(self._prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        slug = unquote(path[1:])
+        redirect = get_cached_url(slug)
+        if not redirect:
+            await self.app(scope, receive, send)
+            return
+        clicks.record_click(slug)
+        self.hits += 1
+        # Lets the metrics middleware label the request like a routed redirect
+        scope["route"] = self._catch_all_route
+        # The max-age of an expiring link shrinks with time, so its headers are not memoized
+        status, headers = self._head(redirect) if redirect[3] is None else self._build_head(redirect)
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
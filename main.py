@@ -1,23 +1,119 @@
+import asyncio
+import logging
+import time
 import uvicorn
-from fastapi import FastAPI
-from fastapi.responses import HTMLResponse, Response
-from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response
 
 from routers import shorten, redirect
 from config import config
+from assets import static_assets
+import analytics
+import clicks
+import db
+import dedup
+import expiry
+import metrics
+from fastpath import RedirectFastPath
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+async def timed_step(func, timeout: float):
+    """Run a blocking startup step off the event loop; returns its result and duration."""
+    start = time.perf_counter()
+    result = await asyncio.wait_for(db.run_db(func), timeout)
+    return result, time.perf_counter() - start
+
+async def fill_slug_pool() -> float:
+    """Buffer the first slugs; on timeout they are allocated on first use instead."""
+    try:
+        return (await timed_step(shorten.init_slug_pool, config.STARTUP_TIMEOUT))[1]
+    except asyncio.TimeoutError:
+        logger.warning(f"Slug allocator was not filled within {config.STARTUP_TIMEOUT}s; continuing")
+        return config.STARTUP_TIMEOUT
+
+async def warm_redirect_cache() -> str:
+    """Cache the most clicked links so a fresh worker serves them from memory."""
+    size = min(config.CACHE_WARMUP_SIZE, config.CACHE_MAX_SIZE)
+    if size <= 0:
+        return "cache warmup disabled"
+    deadline = time.monotonic() + config.CACHE_WARMUP_TIMEOUT
+    try:
+        warmup, seconds = await timed_step(lambda: redirect.warm_cache(size, deadline), config.CACHE_WARMUP_TIMEOUT * 2)
+    except asyncio.TimeoutError:
+        return f"cache warmup timed out after {config.CACHE_WARMUP_TIMEOUT * 2}s"
+    return (
+        f"warmed {warmup['links']} links from {warmup['shards']}/{db.shard_count()} shards "
+        f"covering {warmup['coverage']:.1%} of clicks in {seconds:.3f}s"
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize the database and start background workers on startup; flush pending state on shutdown."""
+    start = time.perf_counter()
+    static_assets.load()
+    try:
+        # Schema creation and migrations must finish before anything else reads the database
+        _, schema_seconds = await timed_step(db.init_db, config.STARTUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise RuntimeError(f"Database initialization did not finish within {config.STARTUP_TIMEOUT}s")
+    clicks.start_click_flusher()
+    if config.ANALYTICS_ENABLED:
+        analytics.start_compactor()
+    if config.SLUG_FILTER_ENABLED:
+        redirect.slug_filter.start()
+    if config.COHERENCE_ENABLED:
+        redirect.cache_coherence.start()
+    if config.SNAPSHOT_FILE:
+        redirect.redirect_snapshot.start()
+    if config.DEDUP_ENABLED:
+        dedup.start_backfill()
+    if config.EXPIRY_ENABLED:
+        # Deleted links are dropped from this worker's caches; other workers read the invalidation log
+        expiry.start_sweeper(shorten.forget_links)
+    slug_seconds, warmup = await asyncio.gather(fill_slug_pool(), warm_redirect_cache())
+    logger.info(
+        f"Started in {time.perf_counter() - start:.3f}s: schema {schema_seconds:.3f}s, "
+        f"slug allocator {slug_seconds:.3f}s, {warmup}"
+    )
+    yield
+    expiry.stop_sweeper()
+    redirect.redirect_snapshot.stop()
+    dedup.stop_backfill()
+    redirect.cache_coherence.stop()
+    clicks.stop_click_flusher()
+    analytics.stop_compactor()
+    redirect.slug_filter.close()
+    db.shutdown_executor()
+    db.close_pool()
+
+app = FastAPI(lifespan=lifespan)
+if config.REDIRECT_FAST_PATH:
+    # Added first so it runs inside the metrics middleware, right before routing
+    app.add_middleware(RedirectFastPath, routes=lambda: app.routes)
+if config.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
 
 app.include_router(shorten.router)
 
-@app.get("/")
-async def read_index():
-    with open("static/index.html") as f:
-        html_content = f.read()
-    return HTMLResponse(content=html_content, headers={"Cache-Control": "no-cache"})
+if config.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def get_metrics():
+        return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.api_route("/", methods=["GET", "HEAD"])
+async def read_index(request: Request):
+    # Served from memory; the ETag lets browsers revalidate with a 304
+    asset, _ = static_assets.get("index.html")
+    return static_assets.response(request, asset, immutable=False)
 
-# Mount the static directory AFTER the specific static file routes
-app.mount("/static", StaticFiles(directory="static"), name="static")
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def read_static(path: str, request: Request):
+    asset, hashed = static_assets.get(path)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return static_assets.response(request, asset, immutable=hashed)
 
 app.include_router(redirect.router)
 
@@ -0,0 +1,208 @@
+import bisect
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config import config
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow writes
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+# A collector returns (label values, value) samples read at scrape time
+Collector = Callable[[], Iterable[Tuple[LabelValues, float]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        if not config.METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}" for labels, value in values]
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets and optional labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (+Inf last)], sum
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        if not config.METRICS_ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def expose(self) -> List[str]:
+        with self._lock:
+            values = [(labels, list(counts), total[0]) for labels, (counts, total) in self._values.items()]
+        lines = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class CallbackMetric:
+    """Counter or gauge whose samples are read from existing statistics at scrape time."""
+
+    def __init__(self, name: str, kind: str, help_text: str, labelnames: Sequence[str], collect: Collector) -> None:
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def expose(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+                for labels, value in self.collect()]
+
+
+_registry: List[Any] = []
+_registry_lock = threading.Lock()
+
+
+def _register(metric: Any) -> Any:
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+
+def counter(name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+    """Create and register a counter."""
+    return _register(Counter(name, help_text, labelnames))
+
+
+def histogram(name: str, help_text: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    """Create and register a histogram."""
+    return _register(Histogram(name, help_text, labelnames, buckets))
+
+
+def register_callback(name: str, kind: str, help_text: str, collect: Collector,
+                      labelnames: Sequence[str] = ()) -> None:
+    """Register a counter or gauge backed by statistics another module already keeps."""
+    _register(CallbackMetric(name, kind, help_text, labelnames, collect))
+
+
+def render() -> str:
+    """Render all registered metrics in the Prometheus text exposition format."""
+    with _registry_lock:
+        registered = list(_registry)
+    lines = []
+    for metric in registered:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+# HTTP request latency, labelled by route template so cardinality stays bounded
+http_request_duration = histogram(
+    "url_shortener_http_request_duration_seconds", "HTTP request latency by route",
+    ("method", "route", "status")
+)
+# Database timing
+db_checkout_wait = histogram(
+    "url_shortener_db_checkout_wait_seconds", "Time spent waiting for a pooled connection"
+)
+db_connection_hold = histogram(
+    "url_shortener_db_connection_hold_seconds", "Time a pooled connection is held, i.e. query and lock wait time"
+)
+db_executor_wait = histogram(
+    "url_shortener_db_executor_wait_seconds", "Time database work waits for a thread in the database executor",
+    ("function",)
+)
+db_call_duration = histogram(
+    "url_shortener_db_call_duration_seconds", "Run time of database functions called through run_db",
+    ("function",)
+)
+db_errors = counter("url_shortener_db_errors_total", "Database errors raised from pooled connections")
+# Slug allocation
+slug_refill_duration = histogram(
+    "url_shortener_slug_refill_duration_seconds", "Time taken to refill the slug allocator buffer",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware that records per-route HTTP latency."""
+
+    def __init__(self, app: Callable) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or not config.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = "500"
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path: Optional[str] = getattr(route, "path", None)
+            if path is None:
+                # Mounted apps such as /static do not set a route
+                path = scope.get("root_path") or "unmatched"
+            http_request_duration.observe(time.perf_counter() - start, scope["method"], path, status)
@@ -1,6 +1,10 @@
-from pydantic import BaseModel, HttpUrl, Field, ConfigDict
-from typing import Optional
-from datetime import datetime
+from pydantic import BaseModel, HttpUrl, Field, ConfigDict, field_validator, model_validator
+from typing import List, Literal, Optional
+from datetime import datetime, timezone
+
+def as_utc(value: datetime) -> datetime:
+    """Convert a datetime to UTC; values without a time zone are taken as UTC."""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
 
 class URLRequest(BaseModel):
     """Request model for URL shortening."""
@@ -16,12 +20,50 @@ class URLRequest(BaseModel):
         max_length=32,
         pattern=r"^[a-zA-Z0-9_/-]+$"
     )
+    redirect_status: Literal[301, 307, 308] = Field(
+        307,
+        description="307 redirects are never cached, so every click is counted. 301 and 308 redirects are permanent and may be cached by browsers and CDNs for cache_max_age seconds."
+    )
+    cache_max_age: Optional[int] = Field(
+        None,
+        description="Seconds a permanent redirect may be cached (default: REDIRECT_DEFAULT_MAX_AGE). Only valid with redirect_status 301 or 308.",
+        ge=0,
+        le=31536000
+    )
+    expires_at: Optional[datetime] = Field(
+        None,
+        description="When the link stops redirecting. Timestamps without a time zone are taken as UTC. Permanent redirects are never cached past this time."
+    )
+    max_clicks: Optional[int] = Field(
+        None,
+        description="Number of clicks after which the link stops redirecting. Only valid with redirect_status 307, since clicks on cached redirects are not counted.",
+        ge=1
+    )
+
+    @field_validator("expires_at")
+    @classmethod
+    def check_expires_at(cls, value: Optional[datetime]) -> Optional[datetime]:
+        if value is None:
+            return None
+        value = as_utc(value)
+        if value <= datetime.now(timezone.utc):
+            raise ValueError("expires_at must be in the future")
+        return value
+
+    @model_validator(mode="after")
+    def check_cache_max_age(self) -> "URLRequest":
+        if self.cache_max_age is not None and self.redirect_status == 307:
+            raise ValueError("cache_max_age requires redirect_status 301 or 308")
+        if self.max_clicks is not None and self.redirect_status != 307:
+            raise ValueError("max_clicks requires redirect_status 307")
+        return self
 
     model_config = ConfigDict(
         json_schema_extra = {
             "example": {
                 "long_url": "https://example.com/very/long/url",
-                "custom_slug": "my/custom/slug"
+                "custom_slug": "my/custom/slug",
+                "redirect_status": 307
             }
         }
     )
@@ -32,6 +74,10 @@ class URLResponse(BaseModel):
     long_url: str = Field(..., description="The original long URL")
     clicks: int = Field(default=0, description="Number of times the URL has been accessed")
     created_at: datetime = Field(..., description="When the URL was shortened")
+    redirect_status: int = Field(default=307, description="HTTP status used for the redirect")
+    cache_max_age: int = Field(default=0, description="Seconds browsers and CDNs may cache the redirect")
+    expires_at: Optional[datetime] = Field(default=None, description="When the link stops redirecting")
+    max_clicks: Optional[int] = Field(default=None, description="Number of clicks after which the link stops redirecting")
 
     model_config = ConfigDict(
         json_schema_extra = {
@@ -39,7 +85,24 @@ class URLResponse(BaseModel):
                 "short_url": "my/blog/post",
                 "long_url": "https://example.com/very/long/url",
                 "clicks": 42,
-                "created_at": "2024-03-20T12:00:00"
+                "created_at": "2024-03-20T12:00:00",
+                "redirect_status": 307,
+                "cache_max_age": 0
             }
         }
     )
+
+class BatchShortenResult(BaseModel):
+    """Per-item result of a batch shortening request."""
+    index: int = Field(..., description="Position of the item in the request")
+    status_code: int = Field(..., description="HTTP status the item would have received from /api/shorten")
+    short_url: Optional[str] = Field(None, description="The shortened URL slug, if created")
+    long_url: Optional[str] = Field(None, description="The original long URL")
+    created_at: Optional[datetime] = Field(None, description="When the URL was shortened")
+    detail: Optional[str] = Field(None, description="Error message for items that were not created")
+
+class BatchShortenResponse(BaseModel):
+    """Response model for batch URL shortening."""
+    created: int = Field(..., description="Number of URLs created")
+    failed: int = Field(..., description="Number of items that were rejected")
+    results: List[BatchShortenResult] = Field(..., description="Results in request order")
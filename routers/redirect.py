@@ -1,55 +1,463 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import RedirectResponse, HTMLResponse, Response
-from typing import Union, List
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import RedirectResponse, HTMLResponse, Response, StreamingResponse
+from typing import AsyncIterator, Literal, Tuple, Union, List
+from datetime import datetime, timezone
+import base64
+import heapq
+import json
+import sqlite3
+import threading
+import time
 import db
+import clicks
+import expiry
 from urllib.parse import unquote
 import logging
 from models import URLResponse
-from typing import Dict, Optional
+from typing import Any, Dict, Optional
+from cache import TTLCache, MISSING
+from bloom import SlugFilter
+from coherence import CacheCoherence
+from snapshot import RedirectSnapshot, UNKNOWN
+from singleflight import SingleFlight
+import singleflight
+from config import config
+import metrics
 
 router = APIRouter()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-# Simple in-memory cache for frequently accessed URLs
-url_cache: Dict[str, Optional[str]] = {}
-MAX_CACHE_SIZE = 1000
+# Long URL, redirect status, max-age and expiry (unix seconds or None) of a link, as cached per slug
+CachedRedirect = Tuple[str, int, int, Optional[int]]
+# Click limit of a link and the clicks stored when it was looked up
+ClickLimit = Tuple[int, int]
+# A link read from the database: its redirect and, for links with max_clicks, its click limit
+LinkLookup = Tuple[CachedRedirect, Optional[ClickLimit]]
+# Returned by fetch_long_url for links that exist but have expired
+EXPIRED = object()
 
-def get_cached_url(slug: str) -> Optional[str]:
-    """Get URL from cache if available."""
-    return url_cache.get(slug)
+# Security headers sent with every redirect
+SECURITY_HEADERS = {
+    "X-Content-Type-Options": "nosniff",
+    "X-Frame-Options": "DENY",
+    "X-XSS-Protection": "1; mode=block",
+}
+# Temporary redirects must reach the origin on every click so each one is counted
+NO_STORE_HEADERS = {
+    **SECURITY_HEADERS,
+    "Cache-Control": "no-cache, no-store, must-revalidate",
+    "Pragma": "no-cache",
+    "Expires": "0"
+}
 
-def cache_url(slug: str, url: str) -> None:
-    """Cache URL with basic size limit."""
-    if len(url_cache) >= MAX_CACHE_SIZE:
-        # Remove oldest entry (simple FIFO)
-        oldest_key = next(iter(url_cache))
-        del url_cache[oldest_key]
-    url_cache[slug] = url
+# Bounded LRU cache of slug -> redirect, plus a short-lived cache of unknown slugs
+url_cache = TTLCache(config.CACHE_MAX_SIZE, config.CACHE_TTL)
+negative_cache = TTLCache(config.NEGATIVE_CACHE_MAX_SIZE, config.NEGATIVE_CACHE_TTL)
+# Counters bumped whenever a slug hashing to the stripe changes. Negative entries hold the value
+# read when their lookup started, so a miss looked up before a create is ignored after it
+INVALIDATION_STRIPES = 4096
+_invalidation_generations = [0] * INVALIDATION_STRIPES
+_generation_lock = threading.Lock()
+
+# Membership filter over all slugs; definite misses are answered without a query
+slug_filter = SlugFilter(config.SLUG_FILTER_CAPACITY, config.SLUG_FILTER_FP_RATE, config.SLUG_FILTER_FILE)
+
+# Concurrent cache misses for the same slug share one lookup
+redirect_lookups = SingleFlight("redirect")
+
+# Read-only snapshot of all links; slugs changed since it was exported are looked up in the database
+redirect_snapshot = RedirectSnapshot(config.SNAPSHOT_FILE)
+
+def is_expired(expires_at: Optional[int]) -> bool:
+    """Check whether a link with the given expiry (unix seconds or None) has expired."""
+    return expires_at is not None and expires_at <= time.time()
+
+def get_cached_url(slug: str) -> Optional[CachedRedirect]:
+    """Get the redirect for a slug from cache if available and not expired."""
+    redirect = url_cache.get(slug)
+    if redirect is MISSING:
+        return None
+    if is_expired(redirect[3]):
+        # Expired links stop redirecting at once, not when the sweeper deletes them
+        url_cache.delete(slug)
+        return None
+    return redirect
+
+def cache_url(slug: str, redirect: CachedRedirect) -> None:
+    """Cache a redirect; the least recently used entry is evicted when the cache is full."""
+    url_cache.set(slug, redirect)
+
+def invalidation_generation(slug: str) -> int:
+    """Return the change counter of a slug's stripe; read it before looking the slug up."""
+    return _invalidation_generations[hash(slug) % INVALIDATION_STRIPES]
+
+def _bump_generation(slug: str) -> None:
+    with _generation_lock:
+        _invalidation_generations[hash(slug) % INVALIDATION_STRIPES] += 1
+
+def is_cached_missing(slug: str) -> bool:
+    """Check whether the slug was recently looked up and not found, and has not changed since."""
+    return negative_cache.get(slug) == invalidation_generation(slug)
+
+def cache_missing(slug: str, generation: int) -> None:
+    """Remember that a slug does not exist for a short time, unless it changed after generation was read."""
+    if generation == invalidation_generation(slug):
+        negative_cache.set(slug, generation)
 
 def invalidate_cache(slug: str) -> None:
     """Remove a URL from the cache."""
-    if slug in url_cache:
-        del url_cache[slug]
+    _bump_generation(slug)
+    url_cache.delete(slug)
+    negative_cache.delete(slug)
+    redirect_lookups.forget(slug)
+    redirect_snapshot.mark_dirty(slug)
+
+def apply_invalidation(shard: int, entry_id: int, slug: str) -> None:
+    """Apply a change logged by any worker to the caches and the snapshot overlay."""
+    _bump_generation(slug)
+    url_cache.delete(slug)
+    negative_cache.delete(slug)
+    redirect_lookups.forget(slug)
+    redirect_snapshot.apply_logged(shard, entry_id, slug)
+
+def clear_caches() -> None:
+    """Remove every entry from the redirect caches."""
+    url_cache.clear()
+    negative_cache.clear()
+    redirect_snapshot.reset()
+
+def warm_cache(limit: int, deadline: float) -> Dict[str, Any]:
+    """
+    Load the most clicked links into the redirect cache, reading idx_urls_clicks
+    on every shard. The hottest links are cached last, so they are evicted last.
+    Expired links and links with a click limit, which are never cached, are skipped.
+    Shards not reached before the deadline (a time.monotonic() value) are skipped.
+    Returns how many links were cached and the share of all clicks they received.
+    """
+    candidates: List[sqlite3.Row] = []
+    total_clicks = 0
+    shards_read = 0
+    for shard in range(db.shard_count()):
+        if time.monotonic() > deadline:
+            break
+        with db.get_db_connection(shard) as conn:
+            candidates.extend(conn.execute(
+                "SELECT slug, long_url, clicks, redirect_status, redirect_max_age, expires_at FROM urls "
+                "WHERE max_clicks IS NULL AND (expires_at IS NULL OR expires_at > ?) "
+                "ORDER BY clicks DESC LIMIT ?",
+                (int(time.time()), limit)
+            ).fetchall())
+            total_clicks += conn.execute("SELECT COALESCE(SUM(clicks), 0) FROM urls").fetchone()[0]
+        shards_read += 1
+    hottest = heapq.nlargest(limit, candidates, key=lambda row: row["clicks"])
+    for row in reversed(hottest):
+        cache_url(row["slug"], (row["long_url"], row["redirect_status"], row["redirect_max_age"], row["expires_at"]))
+    warmed_clicks = sum(row["clicks"] for row in hottest)
+    return {
+        "links": len(hottest),
+        "shards": shards_read,
+        "clicks": warmed_clicks,
+        "coverage": warmed_clicks / total_clicks if total_clicks else 0.0,
+    }
+
+# Applies creates and deletes made by other worker processes to the caches above
+cache_coherence = CacheCoherence(apply_invalidation, clear_caches)
+
+def cache_samples(field: str) -> List[Tuple[Tuple[str, ...], float]]:
+    """Read one statistic from both redirect caches for the metrics endpoint."""
+    return [(("redirect",), url_cache.stats()[field]), (("negative",), negative_cache.stats()[field])]
+
+for field in ("hits", "misses", "evictions", "expirations"):
+    metrics.register_callback(
+        f"url_shortener_cache_{field}_total", "counter", f"Redirect cache {field}",
+        lambda field=field: cache_samples(field), ("cache",)
+    )
+metrics.register_callback("url_shortener_cache_entries", "gauge", "Entries in the redirect caches",
+                          lambda: cache_samples("size"), ("cache",))
+metrics.register_callback("url_shortener_slug_filter_definite_misses_total", "counter",
+                          "Lookups answered as missing by the slug filter",
+                          lambda: [((), slug_filter.definite_misses)])
+metrics.register_callback("url_shortener_slug_filter_false_positives_total", "counter",
+                          "Lookups the slug filter let through that did not exist",
+                          lambda: [((), slug_filter.false_positives)])
+metrics.register_callback("url_shortener_snapshot_lookups_total", "counter",
+                          "Redirect snapshot lookups by result",
+                          lambda: [(("hit",), redirect_snapshot.hits), (("miss",), redirect_snapshot.misses),
+                                   (("fallback",), redirect_snapshot.fallbacks)], ("result",))
+def pool_samples(field: str) -> List[Tuple[Tuple[str, ...], float]]:
+    """Read one connection pool statistic per shard for the metrics endpoint."""
+    return [((str(shard),), db.get_pool(shard).stats()[field]) for shard in range(db.shard_count())]
+
+metrics.register_callback("url_shortener_db_pool_checkouts_total", "counter", "Pooled connection checkouts",
+                          lambda: pool_samples("checkouts"), ("shard",))
+metrics.register_callback("url_shortener_db_pool_timeouts_total", "counter",
+                          "Checkouts that timed out waiting for a pooled connection",
+                          lambda: pool_samples("timeouts"), ("shard",))
+metrics.register_callback("url_shortener_db_pool_idle_connections", "gauge", "Idle pooled connections",
+                          lambda: pool_samples("idle"), ("shard",))
+
+def not_found_response() -> HTMLResponse:
+    """Build the 404 page returned for unknown slugs."""
+    return HTMLResponse(
+        content="""
+        <html>
+            <head>
+                <title>URL Not Found</title>
+            </head>
+            <body>
+                <h1>URL Not Found</h1>
+                <p>The shortened URL you're looking for doesn't exist.</p>
+                <p><a href="/">Create a new shortened URL</a></p>
+            </body>
+        </html>
+        """,
+        status_code=404
+    )
+
+@router.get("/api/cache/stats")
+async def get_cache_stats() -> Dict[str, Any]:
+    """Get hit/miss/eviction counters for the redirect caches."""
+    return {
+        "redirect_cache": url_cache.stats(),
+        "negative_cache": negative_cache.stats(),
+        "slug_filter": slug_filter.stats(),
+        "coherence": cache_coherence.stats(),
+        "snapshot": redirect_snapshot.stats(),
+        "single_flight": singleflight.stats(),
+    }
+
+@router.get("/api/db/stats")
+async def get_db_stats() -> Dict[str, Any]:
+    """Get connection pool size and checkout wait statistics for every shard."""
+    return {
+        "shard_count": db.shard_count(),
+        "pools": [db.get_pool(shard).stats() for shard in range(db.shard_count())],
+        "expiry": expiry.stats(),
+    }
+
+# Sort key of a listed row: (created_at, shard, id)
+CursorKey = Tuple[str, int, int]
+# Larger than any rowid, so "id > MAX_ROWID" matches nothing
+MAX_ROWID = 2 ** 63 - 1
+
+def encode_cursor(created_at: str, shard: int, row_id: int) -> str:
+    """Encode the sort key of the last row of a page as an opaque cursor."""
+    raw = json.dumps([created_at, shard, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> CursorKey:
+    """Decode a cursor produced by encode_cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = json.loads(raw)
+        if len(key) == 2:
+            # Cursors from before sharding refer to shard 0
+            key = [key[0], 0, key[1]]
+        created_at, shard, row_id = key
+        if not isinstance(created_at, str) or not isinstance(shard, int) or not isinstance(row_id, int):
+            raise ValueError("unexpected cursor contents")
+        return created_at, shard, row_id
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+
+def fetch_shard_page(shard: int, after: Optional[CursorKey], limit: int) -> List[Dict[str, Any]]:
+    """
+    Load up to limit URLs from one shard that sort after the given key.
+    Rows are ordered by (created_at DESC, id ASC), which matches idx_urls_created_at
+    (the index stores the rowid in ascending order), so no sort step is needed.
+    """
+    with db.get_db_connection(shard) as conn:
+        if after is None:
+            rows = conn.execute(
+                "SELECT id, slug, long_url, clicks, created_at, redirect_status, redirect_max_age, expires_at, max_clicks "
+                "FROM urls ORDER BY created_at DESC, id ASC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        else:
+            created_at, after_shard, row_id = after
+            # Rows with the cursor's timestamp come after it only on later shards or with a higher id
+            min_id = row_id if shard == after_shard else (0 if shard > after_shard else MAX_ROWID)
+            rows = conn.execute(
+                "SELECT id, slug, long_url, clicks, created_at, redirect_status, redirect_max_age, expires_at, max_clicks "
+                "FROM urls WHERE created_at <= ? AND (created_at < ? OR id > ?) "
+                "ORDER BY created_at DESC, id ASC LIMIT ?",
+                (created_at, created_at, min_id, limit)
+            ).fetchall()
+    return [{**dict(row), "shard": shard} for row in rows]
+
+def fetch_url_page(after: Optional[CursorKey], limit: int) -> List[Dict[str, Any]]:
+    """
+    Load one page of shortened URLs, newest first, starting after the given sort key.
+    Each shard returns its own first page in sort order and the pages are
+    merged, so rows are ordered by (created_at DESC, shard ASC, id ASC).
+    """
+    pages = [fetch_shard_page(shard, after, limit) for shard in range(db.shard_count())]
+    if len(pages) == 1:
+        return pages[0]
+    merged = heapq.merge(*pages, key=lambda row: (row["created_at"], -row["shard"], -row["id"]), reverse=True)
+    return [row for _, row in zip(range(limit), merged)]
+
+def format_timestamp(value: str) -> str:
+    """Format a stored timestamp the way URLResponse serializes created_at."""
+    value = value.replace(" ", "T", 1)
+    if value.endswith("+00:00"):
+        value = value[:-6] + "Z"
+    return value
+
+def format_expiry(expires_at: Optional[int]) -> Optional[str]:
+    """Format a stored expiry the way URLResponse serializes expires_at."""
+    if expires_at is None:
+        return None
+    return datetime.fromtimestamp(expires_at, timezone.utc).isoformat().replace("+00:00", "Z")
+
+async def stream_urls(after: Optional[CursorKey], limit: Optional[int], ndjson: bool) -> AsyncIterator[bytes]:
+    """Stream URLs page by page without building response models."""
+    remaining = limit
+    first = True
+    if not ndjson:
+        yield b"["
+    while remaining is None or remaining > 0:
+        batch_size = config.URL_LIST_MAX_PAGE_SIZE if remaining is None else min(remaining, config.URL_LIST_MAX_PAGE_SIZE)
+        # Each page checks out its own connection so slow clients do not pin one
+        records = await db.run_db(fetch_url_page, after, batch_size)
+        if not records:
+            break
+        chunk = []
+        for rec in records:
+            item = json.dumps({
+                "short_url": rec["slug"],
+                "long_url": rec["long_url"],
+                "clicks": rec["clicks"] + clicks.get_pending_clicks(rec["slug"]),
+                "created_at": format_timestamp(rec["created_at"]),
+                "redirect_status": rec["redirect_status"],
+                "cache_max_age": rec["redirect_max_age"],
+                "expires_at": format_expiry(rec["expires_at"]),
+                "max_clicks": rec["max_clicks"]
+            }, separators=(",", ":"))
+            if ndjson:
+                chunk.append(item + "\n")
+            else:
+                chunk.append(item if first else "," + item)
+            first = False
+        yield "".join(chunk).encode()
+        last = records[-1]
+        after = (last["created_at"], last["shard"], last["id"])
+        if remaining is not None:
+            remaining -= len(records)
+        if len(records) < batch_size:
+            break
+    if not ndjson:
+        yield b"]"
+
+def fetch_long_url(slug: str) -> Union[LinkLookup, None, object]:
+    """Look up the long URL, redirect policy and limits for a slug in the database; None if absent, or EXPIRED."""
+    with db.get_slug_connection(slug) as conn:
+        url_record = conn.execute(
+            "SELECT long_url, redirect_status, redirect_max_age, expires_at, max_clicks, clicks FROM urls WHERE slug = ?",
+            (slug,)
+        ).fetchone()
+    if url_record is None:
+        return None
+    if is_expired(url_record["expires_at"]):
+        return EXPIRED
+    redirect = (url_record["long_url"], url_record["redirect_status"], url_record["redirect_max_age"],
+                url_record["expires_at"])
+    limit = None if url_record["max_clicks"] is None else (url_record["max_clicks"], url_record["clicks"])
+    return redirect, limit
+
+def within_click_limit(slug: str, limit: ClickLimit) -> bool:
+    """
+    Check whether a link may be clicked once more. Clicks this worker has not
+    flushed yet are counted; other workers' unflushed clicks are not, so a
+    link can overshoot its limit by the clicks in flight on other workers.
+    """
+    max_clicks, stored_clicks = limit
+    return stored_clicks + clicks.get_pending_clicks(slug) < max_clicks
+
+async def resolve_redirect(slug: str) -> Optional[LinkLookup]:
+    """
+    Look up a slug that missed the caches and cache the outcome, including misses.
+    Links with a click limit are never cached, so every click checks the limit.
+    Nothing is cached if the slug changed while it was being looked up.
+    """
+    generation = invalidation_generation(slug)
+    # The slug filter rules out unknown slugs without reading the urls table
+    if not slug_filter.might_contain(slug) and await db.run_db(slug_filter.confirm_missing, slug):
+        cache_missing(slug, generation)
+        return None
+    link = await db.run_db(fetch_long_url, slug)
+    if link is None or link is EXPIRED:
+        logger.info(f"URL not found for slug: {slug}")
+        # Expired links stay in the filter until the sweeper deletes them, so they are not false positives
+        if link is None and slug_filter.ready:
+            slug_filter.record_false_positive()
+        cache_missing(slug, generation)
+        return None
+    redirect, limit = link
+    if limit is None and generation == invalidation_generation(slug):
+        cache_url(slug, redirect)
+    return link
+
+def build_redirect(redirect: CachedRedirect) -> RedirectResponse:
+    """Build the redirect response for a link according to its redirect policy."""
+    long_url, status_code, max_age, expires_at = redirect
+    if expires_at is not None and max_age > 0:
+        # Browsers and CDNs must not keep following the redirect after the link expires
+        max_age = min(max_age, max(expires_at - int(time.time()), 0))
+    if max_age > 0:
+        # Browsers and CDNs answer repeat clicks themselves until max-age expires
+        headers = {**SECURITY_HEADERS, "Cache-Control": f"public, max-age={max_age}"}
+    else:
+        headers = NO_STORE_HEADERS
+    return RedirectResponse(url=long_url, status_code=status_code, headers=headers)
 
 @router.get("/api/urls", response_model=List[URLResponse])
-async def get_all_urls():
-    """Get all shortened URLs."""
+async def get_all_urls(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, description="Maximum number of URLs to return"),
+    after: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the previous page"),
+    stream: Optional[Literal["json", "ndjson"]] = Query(None, description="Stream all matching URLs as a JSON array or NDJSON")
+):
+    """
+    Get shortened URLs, newest first, using cursor-based pagination.
+    The cursor for the next page is returned in the X-Next-Cursor and Link headers.
+    With `stream`, rows are written straight from the database until `limit` is reached.
+    """
     try:
-        with db.get_db_connection() as conn:
-            records = conn.execute("SELECT slug, long_url, clicks, created_at FROM urls ORDER BY created_at DESC").fetchall()
-            
-            
-            urls = [
-                URLResponse(
-                    short_url=rec["slug"],
-                    long_url=rec["long_url"],
-                    clicks=rec["clicks"],
-                    created_at=rec["created_at"]
-                ) for rec in records
-            ]
-            return urls
+        after_key = decode_cursor(after) if after else None
+        if stream:
+            return StreamingResponse(
+                stream_urls(after_key, limit, stream == "ndjson"),
+                media_type="application/x-ndjson" if stream == "ndjson" else "application/json"
+            )
+        
+        page_size = min(limit or config.URL_LIST_PAGE_SIZE, config.URL_LIST_MAX_PAGE_SIZE)
+        # Fetch one extra row to know whether another page exists
+        records = await db.run_db(fetch_url_page, after_key, page_size + 1)
+        if len(records) > page_size:
+            records = records[:page_size]
+            last = records[-1]
+            next_cursor = encode_cursor(last["created_at"], last["shard"], last["id"])
+            response.headers["X-Next-Cursor"] = next_cursor
+            response.headers["Link"] = f'</api/urls?limit={page_size}&after={next_cursor}>; rel="next"'
+        
+        urls = [
+            URLResponse(
+                short_url=rec["slug"],
+                long_url=rec["long_url"],
+                clicks=rec["clicks"] + clicks.get_pending_clicks(rec["slug"]),
+                created_at=rec["created_at"],
+                redirect_status=rec["redirect_status"],
+                cache_max_age=rec["redirect_max_age"],
+                expires_at=rec["expires_at"],
+                max_clicks=rec["max_clicks"]
+            ) for rec in records
+        ]
+        return urls
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting all URLs: {e}")
         raise HTTPException(
@@ -88,79 +496,36 @@ async def redirect_to_long_url(slug: str) -> Union[RedirectResponse, HTMLRespons
         decoded_slug = unquote(slug)
         
         # Check cache first
-        cached_url = get_cached_url(decoded_slug)
-        if cached_url:
-            # Still need to increment clicks in database
-            with db.get_db_connection() as conn:
-                conn.execute(
-                    "UPDATE urls SET clicks = clicks + 1 WHERE slug = ?",
-                    (decoded_slug,)
-                )
-            
-            headers = {
-                "X-Content-Type-Options": "nosniff",
-                "X-Frame-Options": "DENY",
-                "X-XSS-Protection": "1; mode=block",
-                "Cache-Control": "no-cache, no-store, must-revalidate",
-                "Pragma": "no-cache",
-                "Expires": "0"
-            }
-            
-            return RedirectResponse(
-                url=cached_url,
-                status_code=307,
-                headers=headers
-            )
+        cached_redirect = get_cached_url(decoded_slug)
+        if cached_redirect:
+            # Clicks are aggregated in memory and flushed in batches
+            clicks.record_click(decoded_slug)
+            return build_redirect(cached_redirect)
         
-        with db.get_db_connection() as conn:
-            # Single transaction: get URL and increment clicks atomically
-            url_record = conn.execute(
-                "SELECT long_url FROM urls WHERE slug = ?",
-                (decoded_slug,)
-            ).fetchone()
-            
-            if url_record is None:
-                logger.info(f"URL not found for slug: {decoded_slug}")
-                return HTMLResponse(
-                    content="""
-                    <html>
-                        <head>
-                            <title>URL Not Found</title>
-                        </head>
-                        <body>
-                            <h1>URL Not Found</h1>
-                            <p>The shortened URL you're looking for doesn't exist.</p>
-                            <p><a href="/">Create a new shortened URL</a></p>
-                        </body>
-                    </html>
-                    """,
-                    status_code=404
-                )
-            
-            # Cache the URL for future requests
-            cache_url(decoded_slug, url_record["long_url"])
-            
-            # Increment the click count in same transaction
-            conn.execute(
-                "UPDATE urls SET clicks = clicks + 1 WHERE slug = ?",
-                (decoded_slug,)
-            )
-            
-            # Set security and no-caching headers
-            headers = {
-                "X-Content-Type-Options": "nosniff",
-                "X-Frame-Options": "DENY",
-                "X-XSS-Protection": "1; mode=block",
-                "Cache-Control": "no-cache, no-store, must-revalidate",
-                "Pragma": "no-cache",
-                "Expires": "0"
-            }
-            
-            return RedirectResponse(
-                url=url_record["long_url"],
-                status_code=307,  # Use 307 for a temporary redirect
-                headers=headers
-            )
+        # Unknown slugs are remembered briefly so repeated probes skip the database
+        if is_cached_missing(decoded_slug):
+            return not_found_response()
+        
+        # The snapshot answers for every link that has not changed since it was exported. Misses go on
+        # to the slug filter and the database, which see links other workers created since the last poll
+        redirect = redirect_snapshot.lookup(decoded_slug)
+        if redirect is not None and redirect is not UNKNOWN:
+            cache_url(decoded_slug, redirect)
+            clicks.record_click(decoded_slug)
+            return build_redirect(redirect)
+        
+        # Concurrent misses for the same slug wait for a single lookup
+        link = await redirect_lookups.do(decoded_slug, lambda: resolve_redirect(decoded_slug))
+        if link is None:
+            return not_found_response()
+        redirect, limit = link
+        if limit is not None and not within_click_limit(decoded_slug, limit):
+            return not_found_response()
+        
+        # Clicks are aggregated in memory and flushed in batches
+        clicks.record_click(decoded_slug)
+        
+        return build_redirect(redirect)
             
     except Exception as e:
         logger.error(f"Error processing redirect for slug {slug}: {e}")
@@ -1,106 +1,383 @@
-import secrets
+import json
 import sqlite3
-from fastapi import APIRouter, HTTPException
+import time
+from fastapi import APIRouter, HTTPException, Query, Request
+from pydantic import ValidationError
 import db
-from models import URLRequest, URLResponse
+import analytics
+import clicks
+from config import config
+from models import URLRequest, URLResponse, BatchShortenResult, BatchShortenResponse, as_utc
 from datetime import datetime, timezone
 from urllib.parse import unquote
 from fastapi.responses import JSONResponse
 import logging
-from typing import Set
+from typing import Any, Dict, Iterable, List, Literal, Optional, Set, Tuple
 import threading
-from routers.redirect import invalidate_cache
+from routers.redirect import format_expiry, invalidate_cache, slug_filter
+from coherence import log_invalidations
+import dedup
+import metrics
+from singleflight import SingleFlight
+from slugs import SlugAllocator, create_slug_allocator, find_existing_slugs
 
 # Reserved words that cannot be used as custom slugs
 RESERVED_SLUGS = {
     "api", "static", "favicon.ico", "apple-touch-icon.png", 
     "apple-touch-icon-precomposed.png", "admin", "root", "www",
     "mail", "ftp", "localhost", "dashboard", "settings", "help",
-    "about", "contact", "privacy", "terms", "robots.txt", "sitemap.xml"
+    "about", "contact", "privacy", "terms", "robots.txt", "sitemap.xml",
+    "metrics"
 }
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Pre-generated slug pool for better performance with thread safety
-slug_pool: Set[str] = set()
-POOL_SIZE = 1000
+# Slug allocator, created on first use
+slug_allocator: Optional[SlugAllocator] = None
+slug_allocator_lock = threading.Lock()
 MAX_GENERATION_ATTEMPTS = 100
-slug_pool_lock = threading.Lock()
 
+# Concurrent analytics requests for the same slug and range share one query
+analytics_lookups = SingleFlight("analytics")
 
+# Batch shortening settings
+# (index, custom slug, long URL, redirect status, max-age, expiry, click limit) of a valid batch item
+BatchItem = Tuple[int, Optional[str], str, int, int, Optional[int], Optional[int]]
+NDJSON_CONTENT_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonlines"}
 
-def refill_slug_pool() -> None:
-    """Refill the slug pool with pre-generated unique slugs."""
-    global slug_pool
-    with slug_pool_lock:
-        with db.get_db_connection() as conn:
-            while len(slug_pool) < POOL_SIZE:
-                candidate = secrets.token_hex(4)
-                if not conn.execute("SELECT 1 FROM urls WHERE slug = ? LIMIT 1", (candidate,)).fetchone():
-                    slug_pool.add(candidate)
+
+def allocator_samples(field: str) -> List[Tuple[Tuple[str, ...], float]]:
+    """Read one allocator statistic for the metrics endpoint, if the allocator exists."""
+    return [((), slug_allocator.stats()[field])] if slug_allocator is not None else []
+
+metrics.register_callback("url_shortener_slug_refills_total", "counter", "Slug allocator refills",
+                          lambda: allocator_samples("refills"))
+metrics.register_callback("url_shortener_slug_collisions_total", "counter",
+                          "Candidate slugs that were already taken", lambda: allocator_samples("collisions"))
+metrics.register_callback("url_shortener_slug_buffered", "gauge", "Slugs buffered by the allocator",
+                          lambda: allocator_samples("buffered"))
+
+
+def is_reserved_slug(slug: str) -> bool:
+    """Checks if a slug collides with a reserved word or path."""
+    return slug in RESERVED_SLUGS or slug.startswith("api/")
+
+def get_slug_allocator() -> SlugAllocator:
+    """Get the process-wide slug allocator, creating it on first use."""
+    global slug_allocator
+    if slug_allocator is None:
+        with slug_allocator_lock:
+            if slug_allocator is None:
+                slug_allocator = create_slug_allocator(is_reserved_slug)
+                slug_allocator.prefilter = slug_filter.filter_possible
+    return slug_allocator
 
 def get_unique_slug_from_pool() -> str:
-    """Get a unique slug from the pre-generated pool."""
-    with slug_pool_lock:
-        if not slug_pool:
-            refill_slug_pool()
-        
-        if slug_pool:
-            return slug_pool.pop()
-    
-    # Fallback to direct generation if pool is empty
-    return generate_unique_slug_fallback()
+    """Get an unused slug from the allocator."""
+    return get_slug_allocator().allocate(1)[0]
 
-def generate_unique_slug_fallback() -> str:
-    """Fallback method for slug generation with attempt limit."""
-    with db.get_db_connection() as conn:
-        for _ in range(MAX_GENERATION_ATTEMPTS):
-            slug = secrets.token_hex(4)
-            if not conn.execute("SELECT 1 FROM urls WHERE slug = ? LIMIT 1", (slug,)).fetchone():
-                return slug
-        
-        # If we can't find a unique slug after max attempts, increase length
-        for _ in range(MAX_GENERATION_ATTEMPTS):
-            slug = secrets.token_hex(6)  # Longer slug
-            if not conn.execute("SELECT 1 FROM urls WHERE slug = ? LIMIT 1", (slug,)).fetchone():
-                return slug
-        
-        raise HTTPException(
-            status_code=500,
-            detail="Unable to generate unique slug after multiple attempts"
-        )
+def get_unique_slugs_from_pool(count: int) -> List[str]:
+    """Get several unused slugs from the allocator."""
+    return get_slug_allocator().allocate(count)
 
 def is_slug_available(slug: str) -> bool:
     """Checks if a slug is available for use."""
-    with db.get_db_connection() as conn:
+    if not slug_filter.might_contain(slug) and slug_filter.confirm_missing(slug):
+        return True
+    with db.get_slug_connection(slug) as conn:
         return not conn.execute("SELECT 1 FROM urls WHERE slug = ? LIMIT 1", (slug,)).fetchone()
 
+def fetch_url_analytics(slug: str) -> Optional[sqlite3.Row]:
+    """Load the stored click count, creation time, redirect policy and limits for a slug."""
+    with db.get_slug_connection(slug) as conn:
+        return conn.execute(
+            "SELECT clicks, created_at, redirect_status, redirect_max_age, expires_at, max_clicks "
+            "FROM urls WHERE slug = ? LIMIT 1",
+            (slug,)
+        ).fetchone()
+
+def get_redirect_policy(url_request: URLRequest) -> Tuple[int, int]:
+    """Return the redirect status and cache max-age to store for a request."""
+    if url_request.redirect_status == 307:
+        return 307, 0
+    max_age = url_request.cache_max_age
+    return url_request.redirect_status, config.REDIRECT_DEFAULT_MAX_AGE if max_age is None else max_age
+
+def get_link_limits(url_request: URLRequest) -> Tuple[Optional[int], Optional[int]]:
+    """Return the expiry (unix seconds) and click limit to store for a request."""
+    expires_at = url_request.expires_at
+    return (int(expires_at.timestamp()) if expires_at else None), url_request.max_clicks
+
+def insert_url(
+    slug: str, long_url: str, created_time: datetime, redirect_status: int = 307, max_age: int = 0,
+    expires_at: Optional[int] = None, max_clicks: Optional[int] = None
+) -> bool:
+    """Insert a URL under the given slug; returns False if the slug is already taken."""
+    with db.get_slug_connection(slug) as conn:
+        conn.execute("BEGIN")
+        try:
+            # INSERT OR IGNORE handles races on the same slug atomically
+            result = conn.execute(
+                "INSERT OR IGNORE INTO urls "
+                "(slug, long_url, created_at, redirect_status, redirect_max_age, url_hash, expires_at, max_clicks) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (slug, long_url, created_time, redirect_status, max_age, dedup.stored_hash(long_url),
+                 expires_at, max_clicks)
+            )
+            if result.rowcount > 0:
+                # Other workers may have cached the slug as missing
+                log_invalidations(conn, [slug])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return result.rowcount > 0
+
+def delete_url_record(slug: str) -> bool:
+    """Delete the URL with the given slug; returns False if it does not exist."""
+    with db.get_slug_connection(slug) as conn:
+        conn.execute("BEGIN")
+        try:
+            result = conn.execute("DELETE FROM urls WHERE slug = ?", (slug,))
+            if result.rowcount > 0:
+                log_invalidations(conn, [slug])
+                analytics.delete_slug_analytics(conn, slug)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return result.rowcount > 0
+
+def forget_links(slugs: Iterable[str]) -> None:
+    """Drop deleted links from the caches, the slug filter and unflushed clicks."""
+    for slug in slugs:
+        invalidate_cache(slug)
+        clicks.discard_pending_clicks(slug)
+        slug_filter.remove(slug)
+
+def normalize_custom_slug(custom_slug: str) -> str:
+    """Normalize a custom slug and reject reserved words."""
+    slug = custom_slug.lower().strip()
+    if is_reserved_slug(slug):
+        raise HTTPException(
+            status_code=400,
+            detail="This slug is reserved and cannot be used"
+        )
+    return slug
+
+def insert_url_batch(
+    items: List[Tuple[Optional[str], str, int, int, Optional[int], Optional[int]]],
+    created_time: datetime,
+    created_times: Optional[List[Optional[datetime]]] = None,
+    click_counts: Optional[List[int]] = None
+) -> List[Optional[str]]:
+    """
+    Insert (custom_slug, long_url, redirect_status, max_age, expires_at, max_clicks)
+    items with one transaction per shard. Items without a custom slug get one from the slug
+    pool. Imports may pass a creation time (None for created_time) and a click
+    count per item. Returns the slug assigned to each item, or None where the
+    custom slug is already taken. With several shards, a failure can leave the
+    items of shards that were already committed inserted.
+    """
+    generated = iter(get_unique_slugs_from_pool(sum(1 for item in items if item[0] is None)))
+    slugs: List[Optional[str]] = [item[0] if item[0] is not None else next(generated) for item in items]
+
+    seen: Set[str] = set()
+    pending: List[int] = []
+    for i, slug in enumerate(slugs):
+        if slug in seen:
+            if items[i][0] is not None:
+                # Custom slug repeated earlier in the batch
+                slugs[i] = None
+                continue
+            while slug in seen:
+                slug = get_unique_slug_from_pool()
+            slugs[i] = slug
+        seen.add(slug)
+        pending.append(i)
+
+    while pending:
+        retry: List[int] = []
+        by_shard: Dict[int, List[int]] = {}
+        for i in pending:
+            by_shard.setdefault(db.shard_for_slug(slugs[i]), []).append(i)
+        for shard, indices in by_shard.items():
+            with db.get_db_connection(shard) as conn:
+                # IMMEDIATE takes the write lock up front, so the existence check below cannot race
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    taken = find_existing_slugs(conn, [slugs[i] for i in indices])
+                    inserted = []
+                    for i in indices:
+                        if slugs[i] not in taken:
+                            inserted.append(i)
+                        elif items[i][0] is not None:
+                            # Custom slug already exists
+                            slugs[i] = None
+                        else:
+                            retry.append(i)
+                    conn.executemany(
+                        "INSERT INTO urls (slug, long_url, created_at, redirect_status, redirect_max_age, url_hash, "
+                        "clicks, expires_at, max_clicks) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        [
+                            (
+                                slugs[i], items[i][1], (created_times and created_times[i]) or created_time,
+                                items[i][2], items[i][3], dedup.stored_hash(items[i][1]),
+                                click_counts[i] if click_counts else 0, items[i][4], items[i][5]
+                            )
+                            for i in inserted
+                        ]
+                    )
+                    log_invalidations(conn, [slugs[i] for i in inserted])
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+        # Generated slugs that collided get replacements, which may live on another shard
+        for i in retry:
+            slug = slugs[i]
+            while slug in seen:
+                slug = get_unique_slug_from_pool()
+            seen.add(slug)
+            slugs[i] = slug
+        pending = retry
+    return slugs
+
+async def deduplicate_batch(
+    pending: List[BatchItem],
+    results: List[Optional[BatchShortenResult]]
+) -> Tuple[List[BatchItem], Dict[int, int]]:
+    """
+    Answer batch items without a custom slug, expiry or click limit from
+    existing links. Returns the items still to insert, and for repeats within
+    the batch the index of the earlier item whose slug they share.
+    """
+    generated = [item[2:5] for item in pending if item[1] is None and item[5] is None and item[6] is None]
+    existing = await db.run_db(dedup.find_existing, generated) if generated else {}
+    first: Dict[dedup.DedupKey, int] = {}
+    repeats: Dict[int, int] = {}
+    remaining = []
+    for item in pending:
+        index, custom_slug, long_url, redirect_status, max_age, expires_at, max_clicks = item
+        if custom_slug is None and expires_at is None and max_clicks is None:
+            row = existing.get((long_url, redirect_status, max_age))
+            if row is not None:
+                results[index] = BatchShortenResult(
+                    index=index, status_code=200, short_url=row["slug"], long_url=row["long_url"],
+                    created_at=row["created_at"]
+                )
+                continue
+            key = (dedup.normalize_url(long_url), redirect_status, max_age)
+            if key in first:
+                repeats[index] = first[key]
+                continue
+            first[key] = index
+        remaining.append(item)
+    return remaining, repeats
+
+async def read_batch_items(request: Request) -> List[Any]:
+    """Read a batch request body as a JSON array or as NDJSON, one object per line."""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in NDJSON_CONTENT_TYPES:
+        items: List[Any] = []
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    items.append(parse_batch_line(line))
+                    if len(items) > config.BATCH_MAX_SIZE:
+                        raise HTTPException(status_code=413, detail=f"Batches are limited to {config.BATCH_MAX_SIZE} items")
+        if buffer.strip():
+            items.append(parse_batch_line(buffer))
+        return items
+
+    try:
+        items = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Request body must be a JSON array or NDJSON")
+    return items
+
+def parse_batch_line(line: bytes) -> Any:
+    """Parse one NDJSON line; malformed lines are kept so they can be reported per item."""
+    try:
+        return json.loads(line)
+    except ValueError:
+        return line.decode(errors="replace")
+
+def format_validation_error(error: ValidationError) -> str:
+    """Summarize a pydantic validation error as a single message."""
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc']) or 'item'}: {err['msg']}" for err in error.errors()
+    )
+
 @router.get("/api/analytics/{slug:path}")
-async def get_url_analytics(slug: str) -> JSONResponse:
+async def get_url_analytics(
+    slug: str,
+    from_time: Optional[datetime] = Query(None, alias="from", description="Start of the time range (default: 24 hours before `to`); times without a zone are UTC"),
+    to_time: Optional[datetime] = Query(None, alias="to", description="End of the time range (default: now); times without a zone are UTC"),
+    granularity: Optional[Literal["minute", "hour", "day"]] = Query(None, description="Bucket size of the returned time series")
+) -> JSONResponse:
     """
     Get analytics for a shortened URL.
-    Returns the click count for the given slug.
+    Returns the click count for the given slug. When `from`, `to` or
+    `granularity` is given, clicks over time are returned as well.
     """
     try:
         decoded_slug = unquote(slug)
-        with db.get_db_connection() as conn:
-            url_record = conn.execute(
-                "SELECT clicks, created_at FROM urls WHERE slug = ? LIMIT 1",
-                (decoded_slug,)
-            ).fetchone()
-            
-            if url_record is None:
-                logger.warning(f"Analytics requested for non-existent slug: {decoded_slug}")
-                raise HTTPException(
-                    status_code=404,
-                    detail="URL not found"
-                )
-            
-            return JSONResponse({
-                "clicks": url_record["clicks"],
-                "created_at": url_record["created_at"]
+        url_record = await analytics_lookups.do(
+            decoded_slug, lambda: db.run_db(fetch_url_analytics, decoded_slug)
+        )
+        
+        if url_record is None:
+            logger.warning(f"Analytics requested for non-existent slug: {decoded_slug}")
+            raise HTTPException(
+                status_code=404,
+                detail="URL not found"
+            )
+        
+        result = {
+            "clicks": url_record["clicks"] + clicks.get_pending_clicks(decoded_slug),
+            "created_at": url_record["created_at"],
+            "redirect_status": url_record["redirect_status"],
+            "cache_max_age": url_record["redirect_max_age"],
+            "expires_at": format_expiry(url_record["expires_at"]),
+            "max_clicks": url_record["max_clicks"],
+            # Clicks answered from browser or CDN caches never reach the server
+            "approximate": url_record["redirect_max_age"] > 0
+        }
+        if from_time or to_time or granularity:
+            granularity = granularity or "hour"
+            # Times without a zone are UTC, like every other timestamp in the API
+            end = as_utc(to_time).timestamp() if to_time else time.time()
+            start = as_utc(from_time).timestamp() if from_time else end - 86400
+            if start >= end:
+                raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+            series_key = (decoded_slug, granularity, int(start), int(end))
+            # Copied because pending clicks are added to it below
+            series = dict(await analytics_lookups.do(
+                series_key, lambda: db.run_db(analytics.query_clicks, *series_key)
+            ))
+            # Include clicks that have not been flushed to the database yet
+            for minute, count in clicks.get_pending_buckets(decoded_slug).items():
+                bucket = analytics.bucket_start(minute, granularity)
+                if start - start % analytics.GRANULARITIES[granularity] <= bucket < end:
+                    series[bucket] = series.get(bucket, 0) + count
+            result.update({
+                "granularity": granularity,
+                "from": datetime.fromtimestamp(start, timezone.utc).isoformat(),
+                "to": datetime.fromtimestamp(end, timezone.utc).isoformat(),
+                "series": [
+                    {"bucket": datetime.fromtimestamp(bucket, timezone.utc).isoformat(), "clicks": series[bucket]}
+                    for bucket in sorted(series)
+                ]
             })
+        
+        return JSONResponse(result)
     except HTTPException:
         raise
     except Exception as e:
@@ -121,44 +398,38 @@ async def create_short_url(
     Returns only the slug, not the full URL.
     """
     long_url = str(url_request.long_url)
+    redirect_status, max_age = get_redirect_policy(url_request)
+    expires_at, max_clicks = get_link_limits(url_request)
     created_time = datetime.now(timezone.utc)
     
     # Generate slug with atomic database operations
     if url_request.custom_slug:
-        slug = url_request.custom_slug.lower().strip()
-        
         # Validate against reserved words
-        if slug in RESERVED_SLUGS or slug.startswith("api/"):
-            raise HTTPException(
-                status_code=400,
-                detail="This slug is reserved and cannot be used"
-            )
-        # Use INSERT OR IGNORE to handle race conditions atomically
+        slug = normalize_custom_slug(url_request.custom_slug)
         try:
-            with db.get_db_connection() as conn:
-                # Try to insert directly - will fail if slug exists
-                result = conn.execute(
-                    "INSERT OR IGNORE INTO urls (slug, long_url, created_at) VALUES (?, ?, ?)",
-                    (slug, long_url, created_time)
-                )
-                if result.rowcount == 0:
-                    # Slug already exists
-                    raise HTTPException(
-                        status_code=409,
-                        detail="This custom slug is already taken"
-                    )
-                logger.info(f"Created short URL: {slug} -> {long_url}")
-                return URLResponse(
-                    short_url=slug,
-                    long_url=long_url,
-                    clicks=0,
-                    created_at=created_time
+            if not await db.run_db(insert_url, slug, long_url, created_time, redirect_status, max_age,
+                                   expires_at, max_clicks):
+                # Slug already exists
+                raise HTTPException(
+                    status_code=409,
+                    detail="This custom slug is already taken"
                 )
-        except sqlite3.IntegrityError:
-            raise HTTPException(
-                status_code=409,
-                detail="This custom slug is already taken"
+            # Drop any cached "not found" entry for the new slug
+            invalidate_cache(slug)
+            slug_filter.add(slug)
+            logger.info(f"Created short URL: {slug} -> {long_url}")
+            return URLResponse(
+                short_url=slug,
+                long_url=long_url,
+                clicks=0,
+                created_at=created_time,
+                redirect_status=redirect_status,
+                cache_max_age=max_age,
+                expires_at=expires_at,
+                max_clicks=max_clicks
             )
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error creating short URL for {long_url}: {e}")
             raise HTTPException(
@@ -166,25 +437,51 @@ async def create_short_url(
                 detail="An error occurred while creating the short URL"
             )
     else:
-        # For auto-generated slugs, use atomic insert with retry logic
+        # Links with an expiry or a click limit are never shared
+        if config.DEDUP_ENABLED and expires_at is None and max_clicks is None:
+            try:
+                existing = await db.run_db(dedup.find_existing, [(long_url, redirect_status, max_age)])
+            except Exception as e:
+                logger.error(f"Error looking up existing short URL for {long_url}: {e}")
+                raise HTTPException(
+                    status_code=500,
+                    detail="An error occurred while creating the short URL"
+                )
+            if existing:
+                row = next(iter(existing.values()))
+                return URLResponse(
+                    short_url=row["slug"],
+                    long_url=row["long_url"],
+                    clicks=row["clicks"] + clicks.get_pending_clicks(row["slug"]),
+                    created_at=row["created_at"],
+                    redirect_status=row["redirect_status"],
+                    cache_max_age=row["redirect_max_age"]
+                )
+
+        # For auto-generated slugs, retry with a new slug on collision
         for _ in range(MAX_GENERATION_ATTEMPTS):
-            slug = get_unique_slug_from_pool()
             try:
-                with db.get_db_connection() as conn:
-                    conn.execute(
-                        "INSERT INTO urls (slug, long_url, created_at) VALUES (?, ?, ?)",
-                        (slug, long_url, created_time)
-                    )
-                    logger.info(f"Created short URL: {slug} -> {long_url}")
-                    return URLResponse(
-                        short_url=slug,
-                        long_url=long_url,
-                        clicks=0,
-                        created_at=created_time
-                    )
-            except sqlite3.IntegrityError:
-                # Slug collision, try again
-                continue
+                # Refilling the pool probes the database, so it runs off the event loop too
+                slug = await db.run_db(get_unique_slug_from_pool)
+                if not await db.run_db(insert_url, slug, long_url, created_time, redirect_status, max_age,
+                                       expires_at, max_clicks):
+                    # Slug collision, try again
+                    continue
+                invalidate_cache(slug)
+                slug_filter.add(slug)
+                logger.info(f"Created short URL: {slug} -> {long_url}")
+                return URLResponse(
+                    short_url=slug,
+                    long_url=long_url,
+                    clicks=0,
+                    created_at=created_time,
+                    redirect_status=redirect_status,
+                    cache_max_age=max_age,
+                    expires_at=expires_at,
+                    max_clicks=max_clicks
+                )
+            except HTTPException:
+                raise
             except Exception as e:
                 logger.error(f"Error creating short URL for {long_url}: {e}")
                 raise HTTPException(
@@ -198,25 +495,93 @@ async def create_short_url(
             detail="Unable to generate a unique slug after multiple attempts"
         )
 
+@router.post(
+    "/api/shorten/batch",
+    response_model=BatchShortenResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {"type": "array", "items": {"$ref": "#/components/schemas/URLRequest"}}
+                },
+                "application/x-ndjson": {"schema": {"$ref": "#/components/schemas/URLRequest"}}
+            }
+        }
+    }
+)
+async def create_short_urls_batch(request: Request) -> BatchShortenResponse:
+    """
+    Creates shortened URLs for a JSON array or NDJSON stream of URL requests.
+    All valid items are inserted in a single transaction per shard. Each item gets
+    its own result, so invalid items and taken custom slugs do not fail the whole batch.
+    In dedup mode, items without a custom slug, expiry or click limit reuse existing links.
+    """
+    raw_items = await read_batch_items(request)
+    if len(raw_items) > config.BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batches are limited to {config.BATCH_MAX_SIZE} items")
+
+    created_time = datetime.now(timezone.utc)
+    results: List[Optional[BatchShortenResult]] = [None] * len(raw_items)
+    pending: List[BatchItem] = []
+    for index, raw in enumerate(raw_items):
+        try:
+            url_request = URLRequest.model_validate(raw)
+            custom_slug = normalize_custom_slug(url_request.custom_slug) if url_request.custom_slug else None
+        except ValidationError as e:
+            results[index] = BatchShortenResult(index=index, status_code=422, detail=format_validation_error(e))
+            continue
+        except HTTPException as e:
+            results[index] = BatchShortenResult(index=index, status_code=e.status_code, detail=e.detail)
+            continue
+        pending.append((
+            index, custom_slug, str(url_request.long_url),
+            *get_redirect_policy(url_request), *get_link_limits(url_request)
+        ))
+
+    repeats: Dict[int, int] = {}
+    if pending and config.DEDUP_ENABLED:
+        pending, repeats = await deduplicate_batch(pending, results)
+
+    if pending:
+        try:
+            slugs = await db.run_db(insert_url_batch, [item[1:] for item in pending], created_time)
+        except Exception as e:
+            logger.error(f"Error creating batch of {len(pending)} short URLs: {e}")
+            raise HTTPException(
+                status_code=500,
+                detail="An error occurred while creating the short URLs"
+            )
+        for (index, _, long_url, *_), slug in zip(pending, slugs):
+            if slug is None:
+                results[index] = BatchShortenResult(
+                    index=index, status_code=409, long_url=long_url, detail="This custom slug is already taken"
+                )
+                continue
+            invalidate_cache(slug)
+            slug_filter.add(slug)
+            results[index] = BatchShortenResult(
+                index=index, status_code=200, short_url=slug, long_url=long_url, created_at=created_time
+            )
+    for index, first_index in repeats.items():
+        results[index] = results[first_index].model_copy(update={"index": index})
+
+    created = sum(1 for result in results if result.status_code == 200)
+    logger.info(f"Created {created} short URLs in batch of {len(raw_items)}")
+    return BatchShortenResponse(created=created, failed=len(results) - created, results=results)
+
 @router.delete("/api/urls/{slug:path}", status_code=204, include_in_schema=False)
 async def delete_url(slug: str):
     """Deletes a shortened URL."""
     try:
         decoded_slug = unquote(slug)
-        with db.get_db_connection() as conn:
-            # Check if the URL exists before deleting
-            existing_url = conn.execute(
-                "SELECT 1 FROM urls WHERE slug = ? LIMIT 1", 
-                (decoded_slug,)
-            ).fetchone()
-            if not existing_url:
-                logger.warning(f"Delete attempted for non-existent slug: {decoded_slug}")
-                raise HTTPException(status_code=404, detail="URL not found")
-            
-            conn.execute("DELETE FROM urls WHERE slug = ?", (decoded_slug,))
-            # Invalidate cache after successful deletion
-            invalidate_cache(decoded_slug)
-            logger.info(f"Deleted URL with slug: {decoded_slug}")
+        if not await db.run_db(delete_url_record, decoded_slug):
+            logger.warning(f"Delete attempted for non-existent slug: {decoded_slug}")
+            raise HTTPException(status_code=404, detail="URL not found")
+        
+        # Invalidate cache and unflushed clicks after successful deletion
+        forget_links([decoded_slug])
+        logger.info(f"Deleted URL with slug: {decoded_slug}")
             
     except HTTPException:
         raise
@@ -227,14 +592,11 @@ async def delete_url(slug: str):
             detail="An error occurred while deleting the URL"
         )
 
-# Initialize slug pool on startup
 def init_slug_pool() -> None:
-    """Initialize the slug pool on application startup."""
+    """Initialize the slug allocator and buffer its first batch on application startup."""
     try:
-        refill_slug_pool()
-        logger.info(f"Initialized slug pool with {len(slug_pool)} slugs")
+        allocator = get_slug_allocator()
+        allocator.fill()
+        logger.info(f"Initialized slug allocator {type(allocator).__name__} with {allocator.stats()['buffered']} slugs")
     except Exception as e:
-        logger.error(f"Failed to initialize slug pool: {e}")
-
-# Initialize slug pool after all function definitions
-init_slug_pool()
+        logger.error(f"Failed to initialize slug allocator: {e}")
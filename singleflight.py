@@ -0,0 +1,82 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple, TypeVar
+
+import metrics
+
+T = TypeVar("T")
+
+# Every group, for the stats endpoint and metrics
+_groups: List["SingleFlight"] = []
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent lookups of the same key within one event loop.
+    The first caller starts the lookup as a task; callers that arrive while it
+    is running wait for the same task and share its result or exception,
+    including None for keys that do not exist. The task is shielded, so a
+    cancelled request does not cancel the lookup for the others. forget() may
+    be called from any thread, e.g. by background workers applying changes.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self._lock = threading.Lock()
+        # Statistics
+        self.lookups = 0
+        self.coalesced = 0
+        _groups.append(self)
+
+    async def do(self, key: Hashable, lookup: Callable[[], Awaitable[T]]) -> T:
+        """Return the result of lookup(), sharing a run already in flight for the key."""
+        with self._lock:
+            task = self._in_flight.get(key)
+            if task is None:
+                self.lookups += 1
+                task = asyncio.ensure_future(lookup())
+                self._in_flight[key] = task
+                task.add_done_callback(lambda done: self._finish(key, done))
+            else:
+                self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        with self._lock:
+            if self._in_flight.get(key) is task:
+                del self._in_flight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved when every waiter was cancelled
+            task.exception()
+
+    def forget(self, key: Hashable) -> None:
+        """Let later callers start a fresh lookup, e.g. after the key changed."""
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return lookup and coalescing counters."""
+        total = self.lookups + self.coalesced
+        return {
+            "lookups": self.lookups,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+            "coalesced_ratio": self.coalesced / total if total else 0.0,
+        }
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    """Return the counters of every group by name."""
+    return {group.name: group.stats() for group in _groups}
+
+
+def _samples(field: str) -> List[Tuple[Tuple[str, ...], float]]:
+    return [((group.name,), getattr(group, field)) for group in _groups]
+
+
+metrics.register_callback("url_shortener_single_flight_lookups_total", "counter",
+                          "Lookups that ran against the database", lambda: _samples("lookups"), ("group",))
+metrics.register_callback("url_shortener_single_flight_coalesced_total", "counter",
+                          "Lookups that waited for an identical one already in flight",
+                          lambda: _samples("coalesced"), ("group",))
@@ -0,0 +1,241 @@
+import hashlib
+import logging
+import secrets
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set
+
+import db
+import metrics
+from config import config
+
+logger = logging.getLogger(__name__)
+
+BASE62_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+# SQLite's default limit on host parameters is 999 on older builds
+QUERY_CHUNK_SIZE = 500
+
+
+def encode_base62(value: int, length: int) -> str:
+    """Encode a non-negative integer as a zero-padded base62 string of the given length."""
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, 62)
+        chars.append(BASE62_ALPHABET[digit])
+    if value:
+        raise ValueError("value does not fit in the requested length")
+    return "".join(reversed(chars))
+
+
+def _feistel_round(value: int, round_index: int, key: bytes, mask: int) -> int:
+    digest = hashlib.blake2b(value.to_bytes(8, "big") + bytes([round_index]), key=key, digest_size=8).digest()
+    return int.from_bytes(digest, "big") & mask
+
+
+def scramble(value: int, space: int, key: bytes, rounds: int = 4) -> int:
+    """
+    Map value to another number in [0, space) with a keyed bijection.
+    A balanced Feistel network permutes the smallest even-width bit range that
+    covers the space; cycle walking re-applies it until the result falls inside.
+    """
+    bits = max(2, (space - 1).bit_length())
+    bits += bits % 2
+    half_bits = bits // 2
+    mask = (1 << half_bits) - 1
+    while True:
+        left, right = value >> half_bits, value & mask
+        for round_index in range(rounds):
+            left, right = right, left ^ _feistel_round(right, round_index, key, mask)
+        value = (left << half_bits) | right
+        if value < space:
+            return value
+
+
+def find_existing_slugs(conn: sqlite3.Connection, slugs: List[str]) -> Set[str]:
+    """Return the subset of slugs that already exist, using one IN query per chunk."""
+    existing: Set[str] = set()
+    for start in range(0, len(slugs), QUERY_CHUNK_SIZE):
+        chunk = slugs[start:start + QUERY_CHUNK_SIZE]
+        placeholders = ",".join("?" * len(chunk))
+        rows = conn.execute(f"SELECT slug FROM urls WHERE slug IN ({placeholders})", chunk).fetchall()
+        existing.update(row["slug"] for row in rows)
+    return existing
+
+
+class SlugAllocator:
+    """
+    Hands out slugs that are not yet used.
+    Subclasses produce candidate batches; each batch is checked against the
+    table with one set-based query and buffered, so allocation itself never
+    touches the database.
+    """
+
+    def __init__(self, is_reserved: Callable[[str], bool]) -> None:
+        self.is_reserved = is_reserved
+        # Optional filter that drops candidates known not to exist before the query
+        self.prefilter: Optional[Callable[[List[str]], List[str]]] = None
+        self._buffer: Deque[str] = deque()
+        self._buffered: Set[str] = set()
+        self._lock = threading.Lock()
+        self.refills = 0
+        self.refill_seconds = 0.0
+        self.collisions = 0
+
+    def _candidates(self) -> List[str]:
+        """Produce the next batch of candidate slugs."""
+        raise NotImplementedError
+
+    def _on_collisions(self, candidates: int, collisions: int) -> None:
+        """Hook called after each refill with the number of candidates already taken."""
+
+    def _refill(self) -> None:
+        start = time.perf_counter()
+        candidates = [slug for slug in self._candidates() if not self.is_reserved(slug)]
+        possible = self.prefilter(candidates) if self.prefilter else candidates
+        taken: Set[str] = set()
+        for shard, shard_slugs in db.group_by_shard(possible).items():
+            with db.get_db_connection(shard) as conn:
+                taken.update(find_existing_slugs(conn, shard_slugs))
+        # Slugs handed out earlier may not be inserted yet, so they count as taken too
+        taken.update(slug for slug in candidates if slug in self._buffered)
+        fresh = [slug for slug in candidates if slug not in taken]
+        self._buffer.extend(fresh)
+        self._buffered.update(fresh)
+        self._on_collisions(len(candidates), len(taken))
+        self.collisions += len(taken)
+        elapsed = time.perf_counter() - start
+        self.refills += 1
+        self.refill_seconds += elapsed
+        metrics.slug_refill_duration.observe(elapsed)
+
+    def allocate(self, count: int = 1) -> List[str]:
+        """Return count unused slugs."""
+        with self._lock:
+            while len(self._buffer) < count:
+                self._refill()
+            slugs = [self._buffer.popleft() for _ in range(count)]
+            self._buffered.difference_update(slugs)
+            return slugs
+
+    def fill(self) -> None:
+        """Buffer a batch of slugs ahead of time if none are buffered."""
+        with self._lock:
+            if not self._buffer:
+                self._refill()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return refill counts and timings."""
+        return {
+            "allocator": type(self).__name__,
+            "buffered": len(self._buffer),
+            "refills": self.refills,
+            "refill_seconds": self.refill_seconds,
+            "collisions": self.collisions,
+        }
+
+
+class CounterSlugAllocator(SlugAllocator):
+    """
+    Allocates slugs from a shared counter in the database, encoded in base62.
+    Each process reserves a block of counter values in a short write
+    transaction, so concurrent workers never hand out the same value. When
+    every value of the current length is used, the next length is started.
+    With scrambling, counter values are permuted with a keyed bijection so
+    consecutive links do not get consecutive slugs.
+    """
+
+    def __init__(self, is_reserved: Callable[[str], bool], min_length: int, block_size: int, scramble_slugs: bool) -> None:
+        super().__init__(is_reserved)
+        self.min_length = min_length
+        self.block_size = block_size
+        self.scramble_slugs = scramble_slugs
+        self._key = self._load_key() if scramble_slugs else b""
+        self.length = min_length
+
+    def _load_key(self) -> bytes:
+        """Load the scramble key shared by all workers, creating it on first use."""
+        if config.SLUG_SCRAMBLE_KEY:
+            return hashlib.sha256(config.SLUG_SCRAMBLE_KEY.encode()).digest()
+        with db.get_db_connection() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO slug_allocator_state (name, value) VALUES ('scramble_key', ?)",
+                (secrets.token_hex(16),)
+            )
+            row = conn.execute("SELECT value FROM slug_allocator_state WHERE name = 'scramble_key'").fetchone()
+        return bytes.fromhex(row["value"])
+
+    def _reserve_block(self) -> Iterable[int]:
+        """Reserve the next block of counter values and return them."""
+        with db.get_db_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT length, next_value FROM slug_counters ORDER BY length DESC LIMIT 1"
+                ).fetchone()
+                if row is None or row["length"] < self.min_length:
+                    length, next_value = self.min_length, 0
+                else:
+                    length, next_value = row["length"], row["next_value"]
+                if next_value >= 62 ** length:
+                    # Keyspace of this length is exhausted, move on to longer slugs
+                    length, next_value = length + 1, 0
+                end = min(next_value + self.block_size, 62 ** length)
+                conn.execute(
+                    "INSERT INTO slug_counters (length, next_value) VALUES (?, ?) "
+                    "ON CONFLICT(length) DO UPDATE SET next_value = excluded.next_value",
+                    (length, end)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if length != self.length:
+            logger.info(f"Slug allocator moved to length {length}")
+            self.length = length
+        return range(next_value, end)
+
+    def _candidates(self) -> List[str]:
+        values = self._reserve_block()
+        space = 62 ** self.length
+        if self.scramble_slugs:
+            return [encode_base62(scramble(value, space, self._key), self.length) for value in values]
+        return [encode_base62(value, self.length) for value in values]
+
+
+class RandomSlugAllocator(SlugAllocator):
+    """
+    Allocates random base62 slugs, checking each batch with one query.
+    The length grows when too many candidates in a batch are already taken.
+    """
+
+    def __init__(self, is_reserved: Callable[[str], bool], min_length: int, block_size: int, max_collision_rate: float) -> None:
+        super().__init__(is_reserved)
+        self.length = min_length
+        self.block_size = block_size
+        self.max_collision_rate = max_collision_rate
+
+    def _candidates(self) -> List[str]:
+        return list({
+            "".join(secrets.choice(BASE62_ALPHABET) for _ in range(self.length))
+            for _ in range(self.block_size)
+        })
+
+    def _on_collisions(self, candidates: int, collisions: int) -> None:
+        if candidates and collisions / candidates > self.max_collision_rate:
+            self.length += 1
+            logger.info(f"Slug collision rate {collisions}/{candidates}; growing slug length to {self.length}")
+
+
+def create_slug_allocator(is_reserved: Callable[[str], bool]) -> SlugAllocator:
+    """Create the slug allocator selected by config.SLUG_ALLOCATOR."""
+    if config.SLUG_ALLOCATOR == "random":
+        return RandomSlugAllocator(
+            is_reserved, config.SLUG_LENGTH, config.SLUG_BLOCK_SIZE, config.SLUG_MAX_COLLISION_RATE
+        )
+    if config.SLUG_ALLOCATOR == "counter":
+        return CounterSlugAllocator(
+            is_reserved, config.SLUG_LENGTH, config.SLUG_BLOCK_SIZE, config.SLUG_SCRAMBLE
+        )
+    raise ValueError(f"Unknown slug allocator: {config.SLUG_ALLOCATOR}")
@@ -0,0 +1,330 @@
+import hashlib
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
+
+import db
+from config import config
+
+logger = logging.getLogger(__name__)
+
+_FILE_MAGIC = b"SLSN"
+_FILE_VERSION = 2
+# magic, version, shard count, record count, slot count, offset of the slot table, build time;
+# followed by the invalidation log position of every shard, the records and the slot table
+_FILE_HEADER = struct.Struct("<4sIIQQQd")
+_SHARD_MARK = struct.Struct("<Q")
+# slug hash (0 marks an empty slot), record offset
+_SLOT = struct.Struct("<QQ")
+# slug length, long URL length, redirect status, max-age, expiry (0 for none), flags;
+# followed by the slug and the long URL
+_RECORD = struct.Struct("<HIHIqB")
+# Set for links with a click limit, which only the database can enforce
+_FLAG_COUNTED = 1
+
+# Returned by lookup() when the snapshot cannot answer and the database must be asked
+UNKNOWN = object()
+
+# Long URL, redirect status, max-age and expiry (unix seconds or None) of a link
+Redirect = Tuple[str, int, int, Optional[int]]
+
+
+def slug_hash(slug: bytes) -> int:
+    """64-bit hash of an encoded slug; never 0, which marks empty slots."""
+    return int.from_bytes(hashlib.blake2b(slug, digest_size=8).digest(), "little") or 1
+
+
+def log_position(conn: sqlite3.Connection) -> int:
+    """Id of the last entry ever written to the shard's invalidation log."""
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'cache_invalidations'").fetchone()
+    return row[0] if row else 0
+
+
+def export_snapshot(path: str, progress: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Compile the urls table of every shard into a snapshot file and atomically
+    replace the file at path. Each shard is read in one transaction together
+    with its invalidation log position, so readers know exactly which slugs
+    changed after the snapshot was taken. Returns the number of links written.
+    """
+    shards = db.shard_count()
+    hashes = array("Q")
+    offsets = array("Q")
+    marks: List[int] = []
+    offset = _FILE_HEADER.size + _SHARD_MARK.size * shards
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.seek(offset)
+            for shard in range(shards):
+                with db.get_db_connection(shard) as conn:
+                    conn.execute("BEGIN")
+                    try:
+                        marks.append(log_position(conn))
+                        cursor = conn.execute(
+                            "SELECT slug, long_url, redirect_status, redirect_max_age, expires_at, max_clicks FROM urls"
+                        )
+                        while True:
+                            rows = cursor.fetchmany(10000)
+                            if not rows:
+                                break
+                            chunk = []
+                            for slug, long_url, status, max_age, expires_at, max_clicks in rows:
+                                slug_bytes = slug.encode()
+                                url_bytes = long_url.encode()
+                                flags = _FLAG_COUNTED if max_clicks is not None else 0
+                                chunk.append(_RECORD.pack(len(slug_bytes), len(url_bytes), status, max_age,
+                                                          expires_at or 0, flags))
+                                chunk.append(slug_bytes)
+                                chunk.append(url_bytes)
+                                hashes.append(slug_hash(slug_bytes))
+                                offsets.append(offset)
+                                offset += _RECORD.size + len(slug_bytes) + len(url_bytes)
+                            f.write(b"".join(chunk))
+                            if progress:
+                                progress(len(hashes))
+                    finally:
+                        conn.execute("COMMIT")
+
+            # Open addressing with linear probing, kept at most half full
+            slot_count = 8
+            while slot_count < len(hashes) * 2:
+                slot_count *= 2
+            mask = slot_count - 1
+            slots = bytearray(slot_count * _SLOT.size)
+            for slot_hash, record_offset in zip(hashes, offsets):
+                index = slot_hash & mask
+                while _SLOT.unpack_from(slots, index * _SLOT.size)[0]:
+                    index = (index + 1) & mask
+                _SLOT.pack_into(slots, index * _SLOT.size, slot_hash, record_offset)
+            f.write(slots)
+
+            f.seek(0)
+            f.write(_FILE_HEADER.pack(_FILE_MAGIC, _FILE_VERSION, shards, len(hashes), slot_count, offset, time.time()))
+            f.write(b"".join(_SHARD_MARK.pack(mark) for mark in marks))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(hashes)
+
+
+class SnapshotFile:
+    """A memory-mapped snapshot file; lookups read the shared page cache directly."""
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, shards, count, slot_count, slots_offset, built_at = _FILE_HEADER.unpack_from(self._mm, 0)
+        if magic != _FILE_MAGIC or version != _FILE_VERSION:
+            raise ValueError("not a redirect snapshot file")
+        if slots_offset + slot_count * _SLOT.size != len(self._mm):
+            raise ValueError("truncated redirect snapshot file")
+        self.shards = shards
+        self.count = count
+        self.built_at = built_at
+        self.marks = [_SHARD_MARK.unpack_from(self._mm, _FILE_HEADER.size + i * _SHARD_MARK.size)[0]
+                      for i in range(shards)]
+        self._slots_offset = slots_offset
+        self._mask = slot_count - 1
+        # Slugs created, changed or deleted since the snapshot was taken
+        self.dirty: Set[str] = set()
+
+    @property
+    def size(self) -> int:
+        return len(self._mm)
+
+    def find(self, slug: str) -> Union[Redirect, None, object]:
+        """Return the link stored for a slug, None if the snapshot has none, or UNKNOWN for counted links."""
+        key = slug.encode()
+        slot_hash = slug_hash(key)
+        mm = self._mm
+        index = slot_hash & self._mask
+        while True:
+            stored_hash, offset = _SLOT.unpack_from(mm, self._slots_offset + index * _SLOT.size)
+            if stored_hash == 0:
+                return None
+            if stored_hash == slot_hash:
+                slug_len, url_len, status, max_age, expires_at, flags = _RECORD.unpack_from(mm, offset)
+                start = offset + _RECORD.size
+                if mm[start:start + slug_len] == key:
+                    if flags & _FLAG_COUNTED:
+                        return UNKNOWN
+                    url_start = start + slug_len
+                    return mm[url_start:url_start + url_len].decode(), status, max_age, expires_at or None
+            index = (index + 1) & self._mask
+
+
+class RedirectSnapshot:
+    """
+    Answers redirect lookups from a snapshot file written by export_snapshot().
+    The snapshot records the invalidation log position of every shard. Slugs
+    logged after that position are kept in an overlay and looked up in the
+    database; this process adds to the overlay through the same invalidation
+    hook that keeps the redirect cache coherent. Every other link is answered
+    without touching SQLite. Misses are not final: a link another worker created
+    since the last poll is not in the overlay yet, so callers must check the
+    database before reporting a slug as missing. A rewritten file is picked up
+    within SNAPSHOT_RELOAD_INTERVAL and swapped in.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file: Optional[SnapshotFile] = None
+        # (inode, mtime) of the last file a load was attempted from
+        self._seen_id: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+        # Invalidations that arrive while a new file is being loaded
+        self._pending: Optional[Set[str]] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.loads = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._file is not None
+
+    def lookup(self, slug: str) -> Union[Redirect, None, object]:
+        """Return the link for a slug, None if the snapshot has no such link, or UNKNOWN to ask the database."""
+        snapshot = self._file
+        if snapshot is None:
+            return UNKNOWN
+        if slug in snapshot.dirty:
+            self.fallbacks += 1
+            return UNKNOWN
+        redirect = snapshot.find(slug)
+        if redirect is UNKNOWN:
+            self.fallbacks += 1
+            return UNKNOWN
+        if redirect is not None and redirect[3] is not None and redirect[3] <= time.time():
+            # Expired but not yet swept
+            redirect = None
+        if redirect is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return redirect
+
+    def mark_dirty(self, slug: str) -> None:
+        """Send future lookups of a changed slug to the database."""
+        with self._lock:
+            if self._file is not None:
+                self._file.dirty.add(slug)
+            if self._pending is not None:
+                self._pending.add(slug)
+
+    def apply_logged(self, shard: int, entry_id: int, slug: str) -> None:
+        """Mark a slug from the invalidation log unless the snapshot already includes the change."""
+        snapshot = self._file
+        if snapshot is not None and entry_id <= snapshot.marks[shard]:
+            return
+        self.mark_dirty(slug)
+
+    def reset(self) -> None:
+        """Stop using the snapshot until it is reloaded, e.g. after missed invalidations."""
+        with self._lock:
+            if self._file is not None:
+                logger.warning("Dropping redirect snapshot until it is reloaded")
+            self._file = None
+            self._seen_id = None
+
+    def load(self) -> bool:
+        """Map the snapshot file and build its overlay from the invalidation logs."""
+        with self._lock:
+            self._pending = set()
+        try:
+            snapshot = SnapshotFile(self.path)
+            if snapshot.shards != db.shard_count():
+                logger.warning(f"Redirect snapshot {self.path} has {snapshot.shards} shards, expected {db.shard_count()}")
+                return False
+            for shard, mark in enumerate(snapshot.marks):
+                with db.get_db_connection(shard) as conn:
+                    position = log_position(conn)
+                    rows = conn.execute("SELECT slug FROM cache_invalidations WHERE id > ?", (mark,)).fetchall()
+                # Log ids are never reused, so any gap means entries were pruned
+                if position < mark or len(rows) != position - mark:
+                    logger.warning(
+                        f"Redirect snapshot {self.path} is older than the invalidation log of shard {shard}; "
+                        f"export a new one"
+                    )
+                    return False
+                snapshot.dirty.update(row[0] for row in rows)
+            with self._lock:
+                snapshot.dirty |= self._pending
+                # Lookups holding the previous file keep it mapped until they finish
+                self._file = snapshot
+            self.loads += 1
+            logger.info(
+                f"Loaded redirect snapshot with {snapshot.count} links ({snapshot.size} bytes), "
+                f"{len(snapshot.dirty)} changed since export"
+            )
+            return True
+        except (OSError, ValueError, struct.error, sqlite3.Error) as e:
+            logger.error(f"Failed to load redirect snapshot from {self.path}: {e}")
+            return False
+        finally:
+            with self._lock:
+                self._pending = None
+
+    def reload_if_changed(self) -> bool:
+        """Load the file if it was replaced since the last attempt."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        file_id = (stat.st_ino, stat.st_mtime_ns)
+        if file_id == self._seen_id:
+            return False
+        self._seen_id = file_id
+        return self.load()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(config.SNAPSHOT_RELOAD_INTERVAL):
+            self.reload_if_changed()
+
+    def start(self) -> None:
+        """Load the snapshot and watch the file for replacements."""
+        if not config.COHERENCE_ENABLED:
+            logger.warning("Redirect snapshot requires COHERENCE_ENABLED to track changed slugs; not using it")
+            return
+        self.reload_if_changed()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="redirect-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop watching the file and unmap the snapshot."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=config.SNAPSHOT_RELOAD_INTERVAL + config.DATABASE_TIMEOUT)
+            self._thread = None
+        with self._lock:
+            self._file = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the loaded snapshot's size and lookup counters."""
+        snapshot = self._file
+        return {
+            "ready": snapshot is not None,
+            "links": snapshot.count if snapshot else 0,
+            "bytes": snapshot.size if snapshot else 0,
+            "built_at": snapshot.built_at if snapshot else None,
+            "changed_since_export": len(snapshot.dirty) if snapshot else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "fallbacks": self.fallbacks,
+            "loads": self.loads,
+        }
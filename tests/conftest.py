@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# Configuration is read when modules are imported, so the environment is set up first
+os.environ["DATABASE_FILE"] = os.path.join(tempfile.mkdtemp(prefix="url-shortener-tests-"), "urls.db")
+os.environ["SHARD_COUNT"] = "2"
+os.environ["SLUG_FILTER_FILE"] = ""
+os.environ["SNAPSHOT_FILE"] = ""
+os.environ["STATIC_DIR"] = os.path.join(REPO_ROOT, "static")
+
+import pytest  # noqa: E402
+
+import db  # noqa: E402
+from config import config  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """An empty, initialized database with two shards, reached through the connection pools."""
+    monkeypatch.setattr(config, "DATABASE_FILE", str(tmp_path / "urls.db"))
+    db.close_pool()
+    db.init_db()
+    yield config.DATABASE_FILE
+    db.close_pool()
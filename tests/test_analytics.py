@@ -0,0 +1,113 @@
+import asyncio
+import json
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import pytest
+
+import analytics
+import db
+from config import config
+from routers.shorten import get_url_analytics, insert_url
+
+SLUG = "stats"
+# Midnight UTC; the clock is stopped a few days later in the middle of an hour
+DAY_START = 1_699_920_000
+NOW = DAY_START + 3 * 86400 + 5 * 3600 + 600
+
+
+@pytest.fixture
+def retention(monkeypatch):
+    monkeypatch.setattr(config, "ANALYTICS_COMPACT_GRACE", 300)
+    monkeypatch.setattr(config, "ANALYTICS_MINUTE_RETENTION_HOURS", 2)
+    monkeypatch.setattr(config, "ANALYTICS_HOUR_RETENTION_DAYS", 1)
+    monkeypatch.setattr(config, "ANALYTICS_DAY_RETENTION_DAYS", 0)
+
+
+def record_clicks(timestamps):
+    minutes = Counter(analytics.bucket_start(ts, "minute") for ts in timestamps)
+    with db.get_slug_connection(SLUG) as conn:
+        conn.execute("BEGIN")
+        analytics.record_buckets(conn, [(SLUG, minute, count) for minute, count in minutes.items()])
+        conn.execute("COMMIT")
+
+
+def expected(timestamps, granularity, start, end):
+    return Counter(analytics.bucket_start(ts, granularity) for ts in timestamps if start <= ts < end)
+
+
+@pytest.fixture
+def clicks(database, retention):
+    # A click every 30 minutes for three days, and every 5 minutes in the last 90 minutes
+    timestamps = list(range(DAY_START + 17, NOW, 1800)) + list(range(NOW - 5400 + 3, NOW, 300))
+    insert_url(SLUG, "https://example.com/", datetime.now(timezone.utc))
+    record_clicks(timestamps)
+    analytics.compact(NOW)
+    return timestamps
+
+
+def table_rows(table):
+    with db.get_slug_connection(SLUG) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table} WHERE slug = ?", (SLUG,)).fetchone()[0]
+
+
+def test_compaction_moves_old_buckets_to_coarser_tables(clicks):
+    # Every level holds part of the history, so queries must combine them
+    assert table_rows("clicks_minute") and table_rows("clicks_hour") and table_rows("clicks_day")
+    with db.get_slug_connection(SLUG) as conn:
+        oldest_minute = conn.execute("SELECT MIN(bucket) FROM clicks_minute").fetchone()[0]
+    assert oldest_minute >= NOW - 2 * 3600
+
+
+def test_daily_series_spans_all_three_tables(clicks):
+    series = analytics.query_clicks(SLUG, "day", DAY_START, NOW)
+    assert series == expected(clicks, "day", DAY_START, NOW)
+    assert sum(series.values()) == len(clicks)
+
+
+def test_hourly_series_within_hour_retention(clicks):
+    start = NOW - 20 * 3600
+    series = analytics.query_clicks(SLUG, "hour", start, NOW)
+    assert series == expected(clicks, "hour", analytics.bucket_start(start, "hour"), NOW)
+
+
+def test_minute_series_within_minute_retention(clicks):
+    start = NOW - 90 * 60
+    assert analytics.query_clicks(SLUG, "minute", start, NOW) == expected(clicks, "minute", start, NOW)
+
+
+def test_ranges_are_widened_to_whole_buckets(clicks):
+    start, end = DAY_START + 86400 + 3600 + 1, DAY_START + 2 * 86400 - 1
+    series = analytics.query_clicks(SLUG, "day", start, end)
+    assert series == expected(clicks, "day", DAY_START + 86400, DAY_START + 2 * 86400)
+
+
+def test_compaction_is_idempotent(clicks):
+    before = analytics.query_clicks(SLUG, "day", DAY_START, NOW)
+    analytics.compact(NOW)
+    analytics.compact(NOW + 60)
+    assert analytics.query_clicks(SLUG, "day", DAY_START, NOW) == before
+
+
+@pytest.fixture
+def server_in_new_york(monkeypatch):
+    monkeypatch.setenv("TZ", "America/New_York")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_analytics_reads_times_without_a_zone_as_utc(database, server_in_new_york):
+    insert_url(SLUG, "https://example.com/", datetime.now(timezone.utc))
+    ten_thirty = int(datetime(2024, 1, 1, 10, 30, tzinfo=timezone.utc).timestamp())
+    # 15:30 UTC is 10:30 in New York, where naive times used to be placed
+    record_clicks([ten_thirty] * 3 + [ten_thirty + 5 * 3600] * 5)
+    response = asyncio.run(get_url_analytics(
+        SLUG, from_time=datetime(2024, 1, 1, 10), to_time=datetime(2024, 1, 1, 11), granularity="hour"
+    ))
+    result = json.loads(response.body)
+    assert result["from"] == "2024-01-01T10:00:00+00:00"
+    assert result["to"] == "2024-01-01T11:00:00+00:00"
+    assert result["series"] == [{"bucket": "2024-01-01T10:00:00+00:00", "clicks": 3}]
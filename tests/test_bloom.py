@@ -0,0 +1,55 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+from bloom import SlugFilter
+from routers.shorten import insert_url
+
+
+def make_filter():
+    slug_filter = SlugFilter(1000, 0.01)
+    slug_filter.build()
+    assert slug_filter.ready
+    return slug_filter
+
+
+def test_slugs_created_elsewhere_are_never_reported_missing(database):
+    slug_filter = make_filter()
+    assert slug_filter.confirm_missing("elsewhere")
+    # Inserted through another connection, as by another worker process
+    insert_url("elsewhere", "https://example.com/", datetime.now(timezone.utc))
+    assert not slug_filter.confirm_missing("elsewhere")
+    slug_filter.close()
+
+
+def test_add_and_remove_do_not_wait_for_a_sync_in_progress(database):
+    slug_filter = make_filter()
+    entered, release = threading.Event(), threading.Event()
+    connection = slug_filter._connection
+
+    class SlowConnection:
+        """Blocks inside the first query, like a sync waiting on a busy database."""
+
+        def __init__(self, conn):
+            self._conn = conn
+
+        def execute(self, *args):
+            entered.set()
+            release.wait(5)
+            return self._conn.execute(*args)
+
+    slug_filter._connection = lambda shard: SlowConnection(connection(shard))
+    sync = threading.Thread(target=slug_filter.confirm_missing, args=("anything",))
+    sync.start()
+    try:
+        assert entered.wait(5)
+        start = time.perf_counter()
+        slug_filter.add("new-slug")
+        slug_filter.remove("old-slug")
+        assert time.perf_counter() - start < 0.5
+        assert slug_filter.might_contain("new-slug")
+    finally:
+        release.set()
+        sync.join()
+    del slug_filter._connection
+    slug_filter.close()
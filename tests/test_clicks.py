@@ -0,0 +1,101 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+import analytics
+import clicks
+import db
+from routers.shorten import insert_url
+
+SLUG = "counted"
+
+
+@pytest.fixture
+def link(database):
+    insert_url(SLUG, "https://example.com/", datetime.now(timezone.utc))
+    yield SLUG
+    clicks.discard_pending_clicks(SLUG)
+
+
+def stored_clicks(slug):
+    with db.get_slug_connection(slug) as conn:
+        return conn.execute("SELECT clicks FROM urls WHERE slug = ?", (slug,)).fetchone()[0]
+
+
+def record(slug, count):
+    for _ in range(count):
+        clicks.record_click(slug)
+
+
+def test_clicks_stay_pending_until_the_flush_commits(link, monkeypatch):
+    record(link, 3)
+    seen = []
+    flush_shard = clicks._flush_shard
+
+    def observe(shard, batch, buckets):
+        seen.append((clicks.get_pending_clicks(link), sum(clicks.get_pending_buckets(link).values())))
+        flush_shard(shard, batch, buckets)
+
+    monkeypatch.setattr(clicks, "_flush_shard", observe)
+    assert clicks.flush_clicks() == 3
+    assert seen == [(3, 3)]
+    assert clicks.get_pending_clicks(link) == 0
+    assert stored_clicks(link) == 3
+
+
+def test_failed_flush_is_retried_without_losing_clicks(link, monkeypatch):
+    record(link, 2)
+    flush_shard = clicks._flush_shard
+
+    def fail(shard, batch, buckets):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(clicks, "_flush_shard", fail)
+    assert clicks.flush_clicks() == 0
+    assert clicks.get_pending_clicks(link) == 2
+    record(link, 1)
+
+    monkeypatch.setattr(clicks, "_flush_shard", flush_shard)
+    assert clicks.flush_clicks() == 3
+    assert clicks.get_pending_clicks(link) == 0
+    assert stored_clicks(link) == 3
+
+
+def test_discarded_clicks_are_not_retried(link, monkeypatch):
+    record(link, 2)
+
+    def fail_after_discard(shard, batch, buckets):
+        clicks.discard_pending_clicks(link)
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(clicks, "_flush_shard", fail_after_discard)
+    clicks.flush_clicks()
+    assert clicks.get_pending_clicks(link) == 0
+    assert clicks.get_pending_buckets(link) == {}
+
+
+def test_late_clicks_are_kept_in_the_series_after_rollup(link):
+    record(link, 4)
+    # Minutes up to a few hours from now are rolled up before the clicks are written
+    later = time.time() + 4 * 3600
+    analytics.compact(later)
+    assert clicks.flush_clicks() == 4
+    series = analytics.query_clicks(link, "hour", int(time.time()) - 3600, int(later))
+    assert sum(series.values()) == 4
+    assert stored_clicks(link) == 4
+
+
+def test_clicks_on_a_deleted_link_leave_no_buckets(link):
+    record(link, 2)
+    with db.get_slug_connection(link) as conn:
+        # Deleted by another worker or the expiry sweeper before the flush
+        conn.execute("BEGIN")
+        conn.execute("DELETE FROM urls WHERE slug = ?", (link,))
+        analytics.delete_slug_analytics(conn, link)
+        conn.execute("COMMIT")
+    clicks.flush_clicks()
+    insert_url(link, "https://example.com/new", datetime.now(timezone.utc))
+    now = int(time.time())
+    assert analytics.query_clicks(link, "minute", now - 3600, now + 60) == {}
+    assert stored_clicks(link) == 0
@@ -0,0 +1,31 @@
+import asyncio
+import threading
+from contextlib import ExitStack
+
+import db
+from config import config
+
+
+def test_executor_threads_never_wait_for_a_pooled_connection(database, monkeypatch):
+    monkeypatch.setattr(config, "DB_POOL_TIMEOUT", 0.5)
+    db.close_pool()
+    db.shutdown_executor()
+    threads = db.executor_threads()
+    # Every executor thread holds a connection to the same shard at once
+    barrier = threading.Barrier(threads, timeout=5)
+
+    def hold_connection():
+        with db.get_db_connection(0) as conn:
+            conn.execute("SELECT 1")
+            barrier.wait()
+
+    async def run_all():
+        await asyncio.gather(*(db.run_db(hold_connection) for _ in range(threads)))
+
+    with ExitStack() as background:
+        # ...while every background thread holds one too
+        for _ in range(db.BACKGROUND_CONNECTIONS):
+            background.enter_context(db.get_db_connection(0))
+        asyncio.run(run_all())
+    assert db.get_pool(0).stats()["timeouts"] == 0
+    db.shutdown_executor()
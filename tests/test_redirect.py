@@ -0,0 +1,58 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from bloom import SlugFilter
+from routers import redirect
+from routers.shorten import insert_url
+
+
+@pytest.fixture
+def slug_filter(database, monkeypatch):
+    """A slug filter built over the test database, used by the redirect route."""
+    # Expired a minute ago and not swept yet
+    insert_url("expired", "https://example.com/expired", datetime.now(timezone.utc), expires_at=int(time.time()) - 60)
+    slug_filter = SlugFilter(1000, 0.01)
+    slug_filter.build()
+    monkeypatch.setattr(redirect, "slug_filter", slug_filter)
+    redirect.url_cache.clear()
+    redirect.negative_cache.clear()
+    yield slug_filter
+    redirect.url_cache.clear()
+    redirect.negative_cache.clear()
+    slug_filter.close()
+
+
+def test_expired_links_are_not_counted_as_false_positives(slug_filter):
+    assert redirect.fetch_long_url("expired") is redirect.EXPIRED
+    assert asyncio.run(redirect.resolve_redirect("expired")) is None
+    assert redirect.is_cached_missing("expired")
+    assert slug_filter.false_positives == 0
+
+
+def test_absent_links_let_through_by_the_filter_are_false_positives(slug_filter, monkeypatch):
+    monkeypatch.setattr(slug_filter, "might_contain", lambda slug: True)
+    assert redirect.fetch_long_url("absent") is None
+    assert asyncio.run(redirect.resolve_redirect("absent")) is None
+    assert slug_filter.false_positives == 1
+
+
+def test_miss_looked_up_before_a_create_is_not_cached(slug_filter, monkeypatch):
+    monkeypatch.setattr(slug_filter, "might_contain", lambda slug: True)
+    fetch_long_url = redirect.fetch_long_url
+
+    def create_during_lookup(slug):
+        link = fetch_long_url(slug)
+        # The create commits and invalidates the caches before the lookup's miss is cached
+        insert_url(slug, "https://example.com/new", datetime.now(timezone.utc))
+        redirect.invalidate_cache(slug)
+        return link
+
+    monkeypatch.setattr(redirect, "fetch_long_url", create_during_lookup)
+    assert asyncio.run(redirect.resolve_redirect("new")) is None
+    assert not redirect.is_cached_missing("new")
+
+    monkeypatch.setattr(redirect, "fetch_long_url", fetch_long_url)
+    assert asyncio.run(redirect.resolve_redirect("new"))[0][0] == "https://example.com/new"
@@ -0,0 +1,57 @@
+import asyncio
+import threading
+
+from singleflight import SingleFlight
+
+
+def test_forget_from_another_thread_starts_a_fresh_lookup():
+    group = SingleFlight("test-forget")
+    runs = []
+
+    async def lookup():
+        runs.append(len(runs))
+        await asyncio.sleep(0.05)
+        return len(runs)
+
+    async def main():
+        first = asyncio.ensure_future(group.do("slug", lookup))
+        await asyncio.sleep(0)
+        # A background worker applies a change while the first lookup is in flight
+        forgetter = threading.Thread(target=group.forget, args=("slug",))
+        forgetter.start()
+        await asyncio.to_thread(forgetter.join)
+        second = await group.do("slug", lookup)
+        return await first, second
+
+    assert asyncio.run(main()) == (2, 2)
+    assert runs == [0, 1]
+    assert group.stats()["in_flight"] == 0
+
+
+def test_concurrent_forgets_leave_lookups_consistent():
+    group = SingleFlight("test-threads")
+    stop = threading.Event()
+
+    def forget_continuously():
+        while not stop.is_set():
+            group.forget(0)
+
+    async def lookup():
+        await asyncio.sleep(0)
+        return "found"
+
+    async def main():
+        return await asyncio.gather(*(group.do(i % 4, lookup) for i in range(2000)))
+
+    threads = [threading.Thread(target=forget_continuously) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        results = asyncio.run(main())
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    assert results == ["found"] * 2000
+    assert group.stats()["in_flight"] == 0
+    assert group.lookups + group.coalesced == 2000
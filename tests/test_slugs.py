@@ -0,0 +1,35 @@
+from slugs import CounterSlugAllocator, scramble
+
+KEY = bytes(range(32))
+
+
+def test_scramble_is_a_bijection_for_each_slug_length():
+    for space in (62, 62 ** 2):
+        assert sorted(scramble(value, space, KEY) for value in range(space)) == list(range(space))
+
+
+def test_scramble_depends_on_the_key():
+    space = 62 ** 2
+    assert [scramble(value, space, KEY) for value in range(50)] != \
+        [scramble(value, space, b"another key") for value in range(50)]
+
+
+def test_counter_allocator_moves_to_longer_slugs_without_repeats(database):
+    allocator = CounterSlugAllocator(lambda slug: False, min_length=1, block_size=25, scramble_slugs=True)
+    slugs = allocator.allocate(200)
+    assert len(set(slugs)) == 200
+    assert all(len(slug) == 1 for slug in slugs[:62])
+    assert all(len(slug) == 2 for slug in slugs[62:])
+    assert allocator.length == 2
+
+
+def test_counter_allocators_in_several_workers_share_the_counter(database):
+    # Each allocator stands for a worker process reserving its own blocks
+    allocators = [CounterSlugAllocator(lambda slug: False, 1, 10, True) for _ in range(3)]
+    slugs = []
+    for _ in range(10):
+        for allocator in allocators:
+            slugs.extend(allocator.allocate(7))
+    assert len(slugs) == 210
+    assert len(set(slugs)) == 210
+    assert {len(slug) for slug in slugs} == {1, 2}
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+from bloom import SlugFilter
+from routers import redirect
+from routers.shorten import insert_url
+from snapshot import RedirectSnapshot, export_snapshot
+
+from conftest import REPO_ROOT
+
+CREATE_IN_OTHER_PROCESS = """
+from datetime import datetime, timezone
+from routers.shorten import insert_url
+assert insert_url("fresh", "https://example.com/fresh", datetime.now(timezone.utc))
+"""
+
+
+@pytest.fixture
+def snapshot_worker(database, tmp_path, monkeypatch):
+    """Redirect route state of a worker serving from a freshly loaded snapshot, before any coherence poll."""
+    insert_url("exported", "https://example.com/exported", datetime.now(timezone.utc))
+    path = str(tmp_path / "urls.snapshot")
+    assert export_snapshot(path) == 1
+    snapshot = RedirectSnapshot(path)
+    assert snapshot.load()
+    slug_filter = SlugFilter(1000, 0.01)
+    slug_filter.build()
+    monkeypatch.setattr(redirect, "redirect_snapshot", snapshot)
+    monkeypatch.setattr(redirect, "slug_filter", slug_filter)
+    redirect.url_cache.clear()
+    redirect.negative_cache.clear()
+    yield snapshot
+    redirect.url_cache.clear()
+    redirect.negative_cache.clear()
+    slug_filter.close()
+
+
+def get(slug):
+    return asyncio.run(redirect.redirect_to_long_url(slug))
+
+
+def test_unchanged_links_are_served_from_the_snapshot(snapshot_worker):
+    response = get("exported")
+    assert response.status_code == 307
+    assert response.headers["location"] == "https://example.com/exported"
+    assert snapshot_worker.hits == 1
+
+
+def test_link_created_by_another_process_is_found_before_the_next_poll(snapshot_worker, database):
+    env = {**os.environ, "DATABASE_FILE": database, "SHARD_COUNT": "2"}
+    subprocess.run([sys.executable, "-c", CREATE_IN_OTHER_PROCESS], cwd=REPO_ROOT, env=env, check=True)
+    # The snapshot does not know the link and no invalidation has been applied yet
+    assert snapshot_worker.lookup("fresh") is None
+    response = get("fresh")
+    assert response.status_code == 307
+    assert response.headers["location"] == "https://example.com/fresh"
+    assert not redirect.is_cached_missing("fresh")
+
+
+def test_unknown_slugs_are_still_not_found(snapshot_worker):
+    assert get("missing").status_code == 404
+    assert redirect.is_cached_missing("missing")
+    assert snapshot_worker.misses == 1
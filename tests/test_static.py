@@ -0,0 +1,34 @@
+import asyncio
+
+import httpx
+
+from main import app
+
+
+def request(method, path, **headers):
+    async def send():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.request(method, path, headers=headers)
+    return asyncio.run(send())
+
+
+def test_head_sends_the_headers_of_get_without_a_body():
+    for path in ("/", "/static/styles.css"):
+        get = request("GET", path, **{"Accept-Encoding": "identity"})
+        head = request("HEAD", path, **{"Accept-Encoding": "identity"})
+        assert get.status_code == head.status_code == 200
+        assert head.content == b""
+        assert head.headers["content-length"] == str(len(get.content))
+        for name in ("etag", "content-type", "cache-control", "vary"):
+            assert head.headers[name] == get.headers[name]
+
+
+def test_matching_etag_is_answered_with_304():
+    etag = request("GET", "/static/styles.css").headers["etag"]
+    for method in ("GET", "HEAD"):
+        response = request(method, "/static/styles.css", **{"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+    assert request("GET", "/static/styles.css", **{"If-None-Match": '"other"'}).status_code == 200
@@ -0,0 +1,41 @@
+"""
+Store the normalized URL hash for rows created before DEDUP_ENABLED was turned on.
+
+The application runs the same backfill in the background on startup; this tool
+does it up front, in short batches, with progress output. It is safe to run
+while the application is serving and to stop and rerun at any time.
+
+Usage (from the repository root, with the application's environment):
+    python -m tools.backfill_url_hashes --batch-size 5000
+"""
+import argparse
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Backfill urls.url_hash for URL deduplication")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows updated per transaction")
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_ROOT)
+    import db
+    import dedup
+    db.init_db()
+
+    def progress(shard: int, updated: int) -> None:
+        print(f"  shard {shard}: {updated} rows updated", file=sys.stderr, end="\r")
+
+    start = time.perf_counter()
+    updated = dedup.backfill_url_hashes(args.batch_size, args.pause, progress)
+    print(file=sys.stderr)
+    db.close_pool()
+    print(f"Backfilled {updated} URL hashes in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
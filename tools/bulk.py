@@ -0,0 +1,320 @@
+"""
+Bulk import and export of links as NDJSON or CSV.
+
+Both directions stream, so memory use depends on the batch size and not on
+the number of links. Records have the fields of the /api/urls listing
+(short_url, long_url, clicks, created_at, redirect_status, cache_max_age,
+expires_at, max_clicks), so an export can be imported into another store. On import, short_url keeps
+the slug exactly; custom_slug is normalized like POST /api/shorten; records
+with neither get a generated slug. Every record is validated like a shorten
+request and each batch is inserted with one transaction per shard. Records
+that cannot be imported are written with the reason to a reject file (NDJSON)
+instead of aborting the run.
+
+Usage (from the repository root, with the application's environment):
+    python -m tools.bulk export links.ndjson
+    python -m tools.bulk export links.csv
+    python -m tools.bulk import links.ndjson --rejects rejects.ndjson
+    python -m tools.bulk import links.csv --batch-size 5000 --workers 4
+Use - for stdin or stdout. The format follows the file extension unless --format is given.
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from pydantic import Field, ValidationError  # noqa: E402
+
+from models import URLRequest, as_utc  # noqa: E402
+
+FIELDS = ["short_url", "long_url", "clicks", "created_at", "redirect_status", "cache_max_age", "expires_at", "max_clicks"]
+INTEGER_FIELDS = ("clicks", "redirect_status", "cache_max_age", "max_clicks")
+EXPORT_PAGE_SIZE = 1000
+PROGRESS_INTERVAL = 1.0
+
+# (line number, parsed record, or the text of a line that is not valid JSON)
+RawRecord = Tuple[int, Any]
+# (line number, slug or None, long URL, redirect status, max-age, expiry, click limit, created at, clicks)
+ImportItem = Tuple[int, Optional[str], str, int, int, Optional[int], Optional[int], Optional[datetime], int]
+# (line number, reason)
+Reject = Tuple[int, str]
+
+
+class ImportRecord(URLRequest):
+    """A shorten request plus the fields an export carries."""
+    short_url: Optional[str] = Field(None, description="Slug to keep exactly as exported")
+    clicks: int = Field(0, ge=0)
+    created_at: Optional[datetime] = None
+
+
+class Progress:
+    """Prints running totals and throughput to stderr at most once per interval."""
+
+    def __init__(self, verb: str) -> None:
+        self.verb = verb
+        self.start = time.perf_counter()
+        self.last_print = 0.0
+        self.done = 0
+        self.rejected = 0
+
+    def update(self, done: int = 0, rejected: int = 0, final: bool = False) -> None:
+        self.done += done
+        self.rejected += rejected
+        now = time.perf_counter()
+        if not final and now - self.last_print < PROGRESS_INTERVAL:
+            return
+        self.last_print = now
+        elapsed = max(now - self.start, 1e-9)
+        rejected_text = f", {self.rejected} rejected" if self.rejected else ""
+        print(
+            f"  {self.done} links {self.verb}{rejected_text} in {elapsed:.1f}s ({self.done / elapsed:.0f} links/s)",
+            file=sys.stderr, end="\n" if final else "\r"
+        )
+
+
+def detect_format(path: str, explicit: Optional[str]) -> str:
+    """Use --format if given, otherwise the file extension."""
+    if explicit:
+        return explicit
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+def open_text(path: str, mode: str) -> TextIO:
+    if path == "-":
+        return sys.stdin if mode == "r" else sys.stdout
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def read_records(stream: TextIO, fmt: str) -> Iterator[RawRecord]:
+    """Yield records one at a time with their line numbers."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            record = {}
+            for key, value in row.items():
+                if key is None or value in (None, ""):
+                    continue
+                if key in INTEGER_FIELDS:
+                    try:
+                        value = int(value)
+                    except ValueError:
+                        pass
+                record[key] = value
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(stream, 1):
+        if line.strip():
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                yield line_number, line.rstrip("\r\n")
+
+
+def batched(records: Iterable[RawRecord], size: int) -> Iterator[List[RawRecord]]:
+    iterator = iter(records)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def validate_batch(batch: List[RawRecord]) -> Tuple[List[ImportItem], List[Reject]]:
+    """Validate records like POST /api/shorten. Runs in worker processes with --workers."""
+    from fastapi import HTTPException
+    from routers.shorten import (
+        get_link_limits, get_redirect_policy, is_reserved_slug, normalize_custom_slug, format_validation_error
+    )
+
+    items: List[ImportItem] = []
+    rejects: List[Reject] = []
+    for line_number, record in batch:
+        if not isinstance(record, dict):
+            rejects.append((line_number, "record is not a JSON object"))
+            continue
+        data = dict(record)
+        # Exports list max-age 0 for temporary redirects, which shorten requests leave out
+        if data.get("cache_max_age") == 0 and data.get("redirect_status", 307) == 307:
+            del data["cache_max_age"]
+        # short_url is validated with the same rules as a custom slug
+        if data.get("short_url") is not None:
+            data["custom_slug"] = data["short_url"]
+        try:
+            request = ImportRecord.model_validate(data)
+            if request.short_url is not None:
+                slug = request.short_url.strip()
+                if is_reserved_slug(slug.lower()):
+                    raise HTTPException(status_code=400, detail="This slug is reserved and cannot be used")
+            elif request.custom_slug:
+                slug = normalize_custom_slug(request.custom_slug)
+            else:
+                slug = None
+        except ValidationError as e:
+            rejects.append((line_number, format_validation_error(e)))
+            continue
+        except HTTPException as e:
+            rejects.append((line_number, e.detail))
+            continue
+        # Timestamps without a zone are taken as UTC, like the stored ones
+        created_at = as_utc(request.created_at) if request.created_at is not None else None
+        items.append((
+            line_number, slug, str(request.long_url), *get_redirect_policy(request), *get_link_limits(request),
+            created_at, request.clicks
+        ))
+    return items, rejects
+
+
+class RejectWriter:
+    """Appends rejected records to an NDJSON file, created on the first reject."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.count = 0
+        self._file: Optional[TextIO] = None
+
+    def write(self, line_number: int, record: Any, reason: str) -> None:
+        if self._file is None:
+            self._file = open(self.path, "w", encoding="utf-8")
+        self._file.write(json.dumps({"line": line_number, "error": reason, "record": record}) + "\n")
+        self.count += 1
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+
+def import_links(args: argparse.Namespace) -> int:
+    from routers import shorten
+
+    fmt = detect_format(args.path, args.format)
+    rejects_path = args.rejects or ("rejects.ndjson" if args.path == "-" else f"{args.path}.rejects.ndjson")
+    reject_writer = RejectWriter(rejects_path)
+    progress = Progress("imported")
+
+    def insert(batch: List[RawRecord], items: List[ImportItem], rejects: List[Reject]) -> None:
+        records = dict(batch)
+        for line_number, reason in rejects:
+            reject_writer.write(line_number, records[line_number], reason)
+        taken = 0
+        if items:
+            slugs = shorten.insert_url_batch(
+                [item[1:7] for item in items],
+                datetime.now(timezone.utc),
+                [item[7] for item in items],
+                [item[8] for item in items]
+            )
+            for item, slug in zip(items, slugs):
+                if slug is None:
+                    reject_writer.write(item[0], records[item[0]], "This slug is already taken")
+                    taken += 1
+        progress.update(len(items) - taken, len(rejects) + taken)
+
+    source = open_text(args.path, "r")
+    executor = ProcessPoolExecutor(args.workers) if args.workers > 1 else None
+    try:
+        print(f"Importing {fmt} from {args.path}", file=sys.stderr)
+        batches = batched(read_records(source, fmt), args.batch_size)
+        if executor is None:
+            for batch in batches:
+                insert(batch, *validate_batch(batch))
+        else:
+            # Validation runs ahead in the workers; inserts stay in input order
+            in_flight = deque()
+            for batch in batches:
+                in_flight.append((batch, executor.submit(validate_batch, batch)))
+                if len(in_flight) > args.workers * 2:
+                    batch, future = in_flight.popleft()
+                    insert(batch, *future.result())
+            while in_flight:
+                batch, future = in_flight.popleft()
+                insert(batch, *future.result())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if source is not sys.stdin:
+            source.close()
+        reject_writer.close()
+    progress.update(final=True)
+    if reject_writer.count:
+        print(f"{reject_writer.count} records rejected; see {rejects_path}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def export_links(args: argparse.Namespace) -> int:
+    from routers.redirect import fetch_url_page, format_expiry, format_timestamp
+
+    fmt = detect_format(args.path, args.format)
+    progress = Progress("exported")
+    target = open_text(args.path, "w")
+    try:
+        writer = csv.DictWriter(target, fieldnames=FIELDS) if fmt == "csv" else None
+        if writer is not None:
+            writer.writeheader()
+        after = None
+        while True:
+            records = fetch_url_page(after, EXPORT_PAGE_SIZE)
+            rows = [
+                {
+                    "short_url": rec["slug"],
+                    "long_url": rec["long_url"],
+                    "clicks": rec["clicks"],
+                    "created_at": format_timestamp(rec["created_at"]),
+                    "redirect_status": rec["redirect_status"],
+                    "cache_max_age": rec["redirect_max_age"],
+                    "expires_at": format_expiry(rec["expires_at"]),
+                    "max_clicks": rec["max_clicks"],
+                }
+                for rec in records
+            ]
+            if writer is not None:
+                writer.writerows(rows)
+            else:
+                target.write("".join(json.dumps(row, separators=(",", ":")) + "\n" for row in rows))
+            progress.update(len(rows))
+            if len(records) < EXPORT_PAGE_SIZE:
+                break
+            last = records[-1]
+            after = (last["created_at"], last["shard"], last["id"])
+    finally:
+        if target is not sys.stdout:
+            target.close()
+    progress.update(final=True)
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk import and export of links as NDJSON or CSV")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Import links from a file")
+    import_parser.add_argument("path", help="NDJSON or CSV file, or - for stdin")
+    import_parser.add_argument("--format", choices=["ndjson", "csv"])
+    import_parser.add_argument("--batch-size", type=int, default=1000, help="Records per transaction")
+    import_parser.add_argument("--workers", type=int, default=1, help="Processes that validate records in parallel")
+    import_parser.add_argument("--rejects", help="Where to write rejected records (default: PATH.rejects.ndjson)")
+    export_parser = subparsers.add_parser("export", help="Export all links, newest first")
+    export_parser.add_argument("path", help="NDJSON or CSV file, or - for stdout")
+    export_parser.add_argument("--format", choices=["ndjson", "csv"])
+    args = parser.parse_args()
+
+    import db
+    db.init_db()
+    try:
+        status = import_links(args) if args.command == "import" else export_links(args)
+    finally:
+        db.close_pool()
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Export the URL store into the memory-mapped snapshot read by redirect workers.
+
+The new file is written next to the target and moved into place with
+os.replace, so workers either see the previous snapshot or the complete new
+one and pick it up within SNAPSHOT_RELOAD_INTERVAL. Safe to run while the
+application is serving. Export more often than COHERENCE_LOG_RETENTION, or
+workers that restart will refuse a snapshot whose changes were pruned.
+
+Usage (from the repository root, with the application's environment):
+    python -m tools.export_snapshot urls.snapshot
+    python -m tools.export_snapshot urls.snapshot --interval 60
+"""
+import argparse
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export links into a memory-mapped redirect snapshot")
+    parser.add_argument("path", help="Snapshot file to write; set SNAPSHOT_FILE to the same path")
+    parser.add_argument("--interval", type=float, default=0,
+                        help="Keep running and export again every this many seconds when links changed")
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_ROOT)
+    import db
+    import snapshot
+    db.init_db()
+
+    def log_positions():
+        positions = []
+        for shard in range(db.shard_count()):
+            with db.get_db_connection(shard) as conn:
+                positions.append(snapshot.log_position(conn))
+        return positions
+
+    def progress(count: int) -> None:
+        print(f"  {count} links exported", file=sys.stderr, end="\r")
+
+    exported = None
+    try:
+        while True:
+            positions = log_positions()
+            if positions != exported:
+                start = time.perf_counter()
+                count = snapshot.export_snapshot(args.path, progress)
+                print(file=sys.stderr)
+                print(
+                    f"Exported {count} links to {args.path} ({os.path.getsize(args.path)} bytes) "
+                    f"in {time.perf_counter() - start:.1f}s",
+                    file=sys.stderr
+                )
+                exported = positions
+            if not args.interval:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Offline tool that redistributes the URL store across a new number of shards.
+
+Reads a single-file database (or an existing set of shards) and writes a new
+set of shard files, routing every slug with the same hash the application
+uses. Stop the application first; the source is only read. Cache invalidation
+logs are not copied because no worker holds a cache across the move.
+
+Usage (from the repository root):
+    python -m tools.reshard urls.db new/urls.db --shards 4
+    python -m tools.reshard urls.db new/urls.db --source-shards 4 --shards 8
+Then point DATABASE_FILE at new/urls.db and set SHARD_COUNT to the new count.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BATCH_SIZE = 10000
+CLICK_TABLES = ("clicks_minute", "clicks_hour", "clicks_day")
+URL_COLUMNS = "slug, long_url, clicks, created_at, redirect_status, redirect_max_age, url_hash, expires_at, max_clicks"
+
+
+def copy_urls(sources: List[sqlite3.Connection], targets: List[sqlite3.Connection], db) -> int:
+    """
+    Copy every URL row to its target shard. Ids are only unique within a shard,
+    so they are reassigned; rows are copied in id order to keep creation order.
+    """
+    copied = 0
+    for source in sources:
+        cursor = source.execute(f"SELECT {URL_COLUMNS} FROM urls ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            by_shard: Dict[int, List[tuple]] = {}
+            for row in rows:
+                by_shard.setdefault(db.shard_for_slug(row[0], len(targets)), []).append(row)
+            for shard, shard_rows in by_shard.items():
+                targets[shard].executemany(
+                    f"INSERT INTO urls ({URL_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", shard_rows
+                )
+            copied += len(rows)
+            print(f"  {copied} URLs copied", file=sys.stderr, end="\r")
+    print(file=sys.stderr)
+    return copied
+
+
+def copy_clicks(sources: List[sqlite3.Connection], targets: List[sqlite3.Connection], db) -> None:
+    """Copy time-bucketed clicks and the rollup watermarks."""
+    for table in CLICK_TABLES:
+        for source in sources:
+            cursor = source.execute(f"SELECT slug, bucket, clicks FROM {table}")
+            while True:
+                rows = cursor.fetchmany(BATCH_SIZE)
+                if not rows:
+                    break
+                by_shard: Dict[int, List[tuple]] = {}
+                for row in rows:
+                    by_shard.setdefault(db.shard_for_slug(row[0], len(targets)), []).append(row)
+                for shard, shard_rows in by_shard.items():
+                    targets[shard].executemany(
+                        f"INSERT INTO {table} (slug, bucket, clicks) VALUES (?, ?, ?) "
+                        f"ON CONFLICT(slug, bucket) DO UPDATE SET clicks = clicks + excluded.clicks",
+                        shard_rows
+                    )
+    # Rollups only ever cover time that every source shard has rolled up
+    watermarks: Dict[str, int] = {}
+    for source in sources:
+        rows = dict(source.execute("SELECT granularity, compacted_until FROM analytics_watermarks").fetchall())
+        for granularity in ("hour", "day"):
+            value = rows.get(granularity, 0)
+            watermarks[granularity] = min(watermarks.get(granularity, value), value)
+    for target in targets:
+        target.executemany(
+            "INSERT INTO analytics_watermarks (granularity, compacted_until) VALUES (?, ?)",
+            [(granularity, value) for granularity, value in watermarks.items() if value]
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reshard the URL store into a new set of SQLite files")
+    parser.add_argument("source", help="DATABASE_FILE of the existing store")
+    parser.add_argument("target", help="DATABASE_FILE of the new store; shard files are created next to it")
+    parser.add_argument("--source-shards", type=int, default=1, help="SHARD_COUNT of the existing store")
+    parser.add_argument("--shards", type=int, required=True, help="SHARD_COUNT of the new store")
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_ROOT)
+    # Configure the application modules for the target before they are imported
+    os.environ["DATABASE_FILE"] = args.target
+    os.environ["SHARD_COUNT"] = str(args.shards)
+
+    source_root, source_ext = os.path.splitext(args.source)
+    source_paths = [args.source] + [f"{source_root}.shard{i}{source_ext}" for i in range(1, args.source_shards)]
+    target_root, target_ext = os.path.splitext(args.target)
+    target_paths = [args.target] + [f"{target_root}.shard{i}{target_ext}" for i in range(1, args.shards)]
+    missing = [path for path in source_paths if not os.path.exists(path)]
+    if missing:
+        parser.error(f"source shard files not found: {', '.join(missing)}")
+    existing = [path for path in target_paths if os.path.exists(path)]
+    if existing:
+        parser.error(f"target files already exist: {', '.join(existing)}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.target)), exist_ok=True)
+    import db
+    db.init_db()
+    db.close_pool()
+
+    start = time.perf_counter()
+    sources = [sqlite3.connect(f"file:{path}?mode=ro", uri=True) for path in source_paths]
+    targets = [sqlite3.connect(path, isolation_level=None) for path in target_paths]
+    for target in targets:
+        target.execute("BEGIN")
+    try:
+        print(f"Copying {len(source_paths)} source shard(s) into {len(target_paths)} shard(s)", file=sys.stderr)
+        copied = copy_urls(sources, targets, db)
+        copy_clicks(sources, targets, db)
+        # Slug allocator state is not sharded and lives in shard 0
+        for table in ("slug_counters", "slug_allocator_state"):
+            rows = sources[0].execute(f"SELECT * FROM {table}").fetchall()
+            if rows:
+                placeholders = ",".join("?" * len(rows[0]))
+                targets[0].executemany(f"INSERT INTO {table} VALUES ({placeholders})", rows)
+        for target in targets:
+            target.execute("COMMIT")
+    except BaseException:
+        # Leave nothing behind so the run can simply be repeated
+        for target in targets:
+            target.close()
+        for path in target_paths:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        raise
+
+    counts = [target.execute("SELECT COUNT(*) FROM urls").fetchone()[0] for target in targets]
+    if sum(counts) != copied:
+        sys.exit(f"Row count mismatch: copied {copied}, found {sum(counts)}")
+    for conn in sources + targets:
+        conn.close()
+    print(
+        f"Resharded {copied} URLs in {time.perf_counter() - start:.1f}s; rows per shard: {counts}. "
+        f"Set DATABASE_FILE={args.target} and SHARD_COUNT={args.shards}.",
+        file=sys.stderr
+    )
+
+
+if __name__ == "__main__":
+    main()